@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# Compares request throughput and connections opened for different aiohttp session setups against a local HTTPS simulator
+# Requires the openssl CLI to generate a throwaway certificate
+# Usage: python benchmarks/bench_connector.py [number of requests]
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import subprocess
+import aiohttp
+from aiohttp import web
+
+benchmarks_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(benchmarks_dir))
+sys.path.insert(0, benchmarks_dir)
+
+from simulator import Simulator, parse_args, ssl_context
+from tap_acuite.utility import create_session
+
+port = 8443
+concurrency = 32
+
+
+def make_certificate(directory):
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=localhost",
+            "-keyout",
+            keyfile,
+            "-out",
+            certfile,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return certfile, keyfile
+
+
+def connection_counter():
+    counts = {"connections": 0}
+    trace = aiohttp.TraceConfig()
+
+    async def on_connection_create_end(session, context, params):
+        counts["connections"] += 1
+
+    trace.on_connection_create_end.append(on_connection_create_end)
+    return counts, trace
+
+
+async def run(name, make_session, requests):
+    counts, trace = connection_counter()
+    session = make_session()
+    session.trace_configs.append(trace)
+    trace.freeze()
+    sem = asyncio.Semaphore(concurrency)
+    url = f"https://localhost:{port}/projects/1/hse/events/"
+
+    async def get(i):
+        async with sem:
+            async with session.get(url + str(i)) as resp:
+                await resp.read()
+
+    start = time.perf_counter()
+    async with session:
+        await asyncio.gather(*[get(i) for i in range(requests)])
+    elapsed = time.perf_counter() - start
+    print(
+        f"{name:>12}: {requests / elapsed:,.0f} requests/sec, {counts['connections']} connections opened"
+    )
+
+
+async def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    config = {"api_key": "benchmark", "verify_ssl": False}
+
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = make_certificate(directory)
+        args = parse_args(
+            ["--certfile", certfile, "--keyfile", keyfile, "--latency", "0.005"]
+        )
+        runner = web.AppRunner(Simulator(args).app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(
+            runner, "localhost", port, ssl_context=ssl_context(args)
+        ).start()
+
+        try:
+            # no connection reuse at all, i.e. a handshake per request
+            await run(
+                "no reuse",
+                lambda: aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(ssl=False, force_close=True)
+                ),
+                requests,
+            )
+            # what run_async used before connector settings were configurable
+            await run(
+                "defaults",
+                lambda: aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(ssl=False),
+                    timeout=aiohttp.ClientTimeout(total=90),
+                ),
+                requests,
+            )
+            await run("tuned", lambda: create_session(config), requests)
+            await run(
+                "uncompressed",
+                lambda: create_session({**config, "compression": False}),
+                requests,
+            )
+        finally:
+            await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
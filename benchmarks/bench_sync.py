@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# Runs the tap end to end against the local simulator and reports throughput, peak memory and request counts
+# Any arguments are passed through to the simulator, e.g.
+#   python benchmarks/bench_sync.py --projects 200 --latency 0.02 --fail-rate 0.01
+# Extra tap config can be given as JSON in the BENCH_CONFIG environment variable
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import subprocess
+import urllib.request
+from collections import Counter
+
+benchmarks_dir = os.path.dirname(os.path.realpath(__file__))
+root_dir = os.path.dirname(benchmarks_dir)
+sys.path.insert(0, root_dir)
+
+from tap_acuite import get_catalog
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def wait_for(url, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with urllib.request.urlopen(url) as resp:
+                return json.load(resp)
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def write_files(directory, port):
+    config = {
+        "api_key": "benchmark",
+        "base_url": f"http://localhost:{port}/",
+        **json.loads(os.environ.get("BENCH_CONFIG", "{}")),
+    }
+    catalog = get_catalog()
+    for stream in catalog["streams"]:
+        stream["schema"]["selected"] = True
+
+    paths = {}
+    for name, content in [("config", config), ("catalog", catalog)]:
+        paths[name] = os.path.join(directory, name + ".json")
+        with open(paths[name], "w") as file:
+            json.dump(content, file)
+    return paths
+
+
+def run_tap(paths):
+    env = {**os.environ, "PYTHONPATH": root_dir}
+    command = [
+        sys.executable,
+        "-c",
+        "import tap_acuite; tap_acuite.main()",
+        "--config",
+        paths["config"],
+        "--properties",
+        paths["catalog"],
+    ]
+    records = Counter()
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull:
+        process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=devnull, env=env
+        )
+        for line in process.stdout:
+            message = json.loads(line)
+            if message["type"] == "RECORD":
+                records[message["stream"]] += 1
+        # wait4 rather than wait, so the peak RSS is the tap's alone and not the simulator's
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    return process.returncode, records, elapsed, usage.ru_maxrss / 1024
+
+
+def main():
+    port = free_port()
+    env = {**os.environ, "PYTHONPATH": root_dir}
+    simulator = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(benchmarks_dir, "simulator.py"),
+            "--port",
+            str(port),
+        ]
+        + sys.argv[1:],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env=env,
+    )
+    try:
+        wait_for(f"http://localhost:{port}/_simulator/requests")
+        with tempfile.TemporaryDirectory() as directory:
+            returncode, records, elapsed, peak_rss = run_tap(
+                write_files(directory, port)
+            )
+        requests = wait_for(f"http://localhost:{port}/_simulator/requests")
+    finally:
+        simulator.terminate()
+        simulator.wait()
+
+    total = sum(records.values())
+    print(f"exit code: {returncode}")
+    print(f"elapsed: {elapsed:.2f}s")
+    print(f"records: {total} ({total / elapsed:,.0f} records/sec)")
+    print(f"peak RSS: {peak_rss:.1f}MB")
+    print(f"requests: {sum(requests.values())}")
+    for family, count in sorted(requests.items()):
+        print(f"  {family}: {count}")
+    print("records by stream:")
+    for stream, count in sorted(records.items()):
+        print(f"  {stream}: {count}")
+    if returncode != 0:
+        sys.exit(returncode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# Compares the per-record singer.Transformer path with the compiled per-stream transformer
+# Usage: python benchmarks/bench_transform.py [number of records]
+import sys
+import time
+import singer
+from singer import metadata
+
+from tap_acuite import get_catalog
+from tap_acuite.transform import compile_transformer
+
+
+def make_hsevent(i):
+    return {
+        "Id": i,
+        "ProjectId": i % 500,
+        "Name": f"Event {i}",
+        "SubCategory": {"Id": i % 40, "Name": "Slip", "ParentCategory": {"Id": 3}},
+        "Description": "Worker slipped on wet surface near the site entrance " * 3,
+        "DateReported": "2020-11-02T09:15:00",
+        "DateOccurred": "2020-11-01T16:45:00",
+        "CompanyInvolved": {"Id": 12, "Name": "Foster Construction"},
+        "SiteAddress": "1 Example Street",
+        "SeriousHarm": False,
+        "ActionTaken": "Area cordoned off",
+        "ActionCausingIncident": {"Id": 1, "Name": "Walking"},
+        "ObjectOrConditionCausingIncident": {"Id": 2, "Name": "Wet floor"},
+        "ContributingFactor": {"Id": 3, "Name": "Weather"},
+        "PreventativeAction": "Signage",
+        "WeatherConditions": "Rain",
+        "SignificantHazard": True,
+        "DateCreated": "2020-11-02T09:15:00",
+        "IsDeleted": False,
+        "DateLastModified": "2020-11-02T09:15:00",
+    }
+
+
+def singer_path(rows, schema, mdata):
+    for row in rows:
+        with singer.Transformer() as transformer:
+            transformer.transform(row, schema, metadata=metadata.to_map(mdata))
+
+
+def compiled_path(rows, schema, mdata):
+    transform = compile_transformer(schema, mdata)
+    for row in rows:
+        transform(row)
+
+
+def run(name, func, rows, schema, mdata):
+    start = time.perf_counter()
+    func(rows, schema, mdata)
+    elapsed = time.perf_counter() - start
+    print(f"{name:>10}: {len(rows) / elapsed:,.0f} records/sec ({elapsed:.2f}s)")
+    return elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    stream = next(
+        s for s in get_catalog()["streams"] if s["tap_stream_id"] == "hsevents"
+    )
+    schema, mdata = stream["schema"], stream["metadata"]
+
+    # sanity check that both paths agree before timing them
+    with singer.Transformer() as transformer:
+        expected = transformer.transform(
+            make_hsevent(1), schema, metadata=metadata.to_map(mdata)
+        )
+    assert compile_transformer(schema, mdata)(make_hsevent(1)) == expected
+
+    baseline = run(
+        "singer", singer_path, [make_hsevent(i) for i in range(count)], schema, mdata
+    )
+    compiled = run(
+        "compiled",
+        compiled_path,
+        [make_hsevent(i) for i in range(count)],
+        schema,
+        mdata,
+    )
+    print(f"{'speedup':>10}: {baseline / compiled:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
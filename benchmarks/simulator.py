@@ -0,0 +1,313 @@
+#!/usr/bin/env python
+# Local stand-in for the Acuite API, serving synthetic data for every endpoint the tap uses
+# Recorded responses can be replayed with --fixtures DIR, where DIR mirrors the URL paths, e.g. DIR/projects/12/audits/34.json
+# Point the tap at it with "base_url": "http://localhost:8765/" in config.json
+# Usage: python benchmarks/simulator.py --projects 50 --latency 0.05 --fail-rate 0.02
+import os
+import ssl
+import json
+import hashlib
+import random
+import asyncio
+import argparse
+from collections import Counter
+from aiohttp import web
+
+from tap_acuite.limiter import endpoint_family
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulated Acuite API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--projects", type=int, default=20)
+    parser.add_argument("--companies", type=int, default=250)
+    parser.add_argument("--people", type=int, default=230)
+    parser.add_argument("--locations", type=int, default=30)
+    parser.add_argument("--audits", type=int, default=5, help="audits per project")
+    parser.add_argument("--events", type=int, default=8, help="hsevents per project")
+    parser.add_argument(
+        "--latency", type=float, default=0.002, help="seconds per request"
+    )
+    parser.add_argument(
+        "--slow",
+        action="append",
+        default=[],
+        metavar="FAMILY=SECONDS",
+        help="extra latency for an endpoint family, e.g. projects/{id}/audits/{id}=2",
+    )
+    parser.add_argument(
+        "--slow-rate",
+        type=float,
+        default=1,
+        help="fraction of requests to a --slow family that get its extra latency",
+    )
+    parser.add_argument("--fail-rate", type=float, default=0, help="fraction of 500s")
+    parser.add_argument(
+        "--throttle-rate", type=float, default=0, help="fraction of 429s"
+    )
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--max-page-size",
+        type=int,
+        help="cap the page size the tap asks for, to force more pages",
+    )
+    parser.add_argument("--fixtures", help="directory of recorded responses")
+    parser.add_argument("--certfile", help="serve HTTPS with this certificate")
+    parser.add_argument("--keyfile")
+    return parser.parse_args(argv)
+
+
+# lastModifiedSince is honoured for items that have a DateLastModified, as the API does
+def modified_since(request, items):
+    since = request.query.get("lastModifiedSince")
+    if not since:
+        return items
+    return [i for i in items if i.get("DateLastModified", since) >= since]
+
+
+def paginate(request, items, max_page_size=None):
+    items = modified_since(request, items)
+    page_number = int(request.query.get("pageNumber", 1))
+    page_size = int(request.query.get("pageSize", 1000))
+    if max_page_size:
+        page_size = min(page_size, max_page_size)
+    pages = max(1, -(-len(items) // page_size))
+    start = (page_number - 1) * page_size
+    return {"Data": {"NumberOfPages": pages, "Items": items[start : start + page_size]}}
+
+
+def modified(i):
+    return f"2020-{1 + i % 12:02}-{1 + i % 28:02}T00:00:00"
+
+
+class Simulator:
+    def __init__(self, args):
+        self.args = args
+        self.slow = {
+            family: float(seconds)
+            for family, seconds in (s.rsplit("=", 1) for s in args.slow)
+        }
+        self.random = random.Random(args.seed)
+        self.requests = Counter()
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/_simulator/requests", self.stats)
+        app.router.add_get("/{path:.*}", self.handle)
+        return app
+
+    # request counts per endpoint family, for benchmark reports
+    async def stats(self, request):
+        return web.json_response(dict(self.requests))
+
+    async def handle(self, request):
+        path = request.match_info["path"].strip("/")
+        family = endpoint_family(path)
+        self.requests[family] += 1
+
+        await asyncio.sleep(self.args.latency + self.extra_latency(family))
+        roll = self.random.random()
+        if roll < self.args.fail_rate:
+            return web.Response(status=500)
+        if roll > 1 - self.args.throttle_rate:
+            return web.Response(
+                status=429, headers={"Retry-After": str(self.args.retry_after)}
+            )
+
+        body = self.fixture(request, path)
+        if body is None:
+            body = self.route(request, path.split("/"))
+        if body is None:
+            return web.Response(status=404)
+        response = web.json_response(body)
+        # detail endpoints support conditional requests
+        if family.endswith("{id}"):
+            etag = '"%s"' % hashlib.sha1(response.body).hexdigest()
+            if request.headers.get("If-None-Match") == etag:
+                return web.Response(status=304, headers={"ETag": etag})
+            response.headers["ETag"] = etag
+        # like the real API, compress when the client asks for it
+        if "gzip" in request.headers.get("Accept-Encoding", ""):
+            response.enable_compression()
+        return response
+
+    # with --slow-rate below 1 response times vary within a family, as they do with the size of what's asked for
+    def extra_latency(self, family):
+        if family not in self.slow:
+            return 0
+        if self.args.slow_rate < 1 and self.random.random() >= self.args.slow_rate:
+            return 0
+        return self.slow[family]
+
+    # recorded responses take precedence over synthetic ones
+    def fixture(self, request, path):
+        if not self.args.fixtures:
+            return None
+        fixture_path = os.path.join(self.args.fixtures, path + ".json")
+        if not os.path.exists(fixture_path):
+            return None
+        with open(fixture_path) as file:
+            body = json.load(file)
+
+        # list endpoints are re-paginated, so a fixture can hold every item in one file
+        data = body.get("Data")
+        if isinstance(data, dict) and "Items" in data:
+            items = data["Items"]
+            if path == "locations" and "countryId" in request.query:
+                country = int(request.query["countryId"])
+                items = [
+                    i for i in items if (i.get("Country") or {}).get("Id") == country
+                ]
+            return paginate(request, items, self.args.max_page_size)
+        return body
+
+    def route(self, request, parts):
+        args = self.args
+        page_size = args.max_page_size
+        if parts == ["companies"]:
+            return paginate(
+                request, [self.company(i) for i in range(args.companies)], page_size
+            )
+        if parts == ["locations"]:
+            country = int(request.query.get("countryId", 0))
+            return paginate(
+                request,
+                [self.location(country, i) for i in range(args.locations)],
+                page_size,
+            )
+        if parts == ["people"]:
+            return paginate(
+                request, [self.person(i) for i in range(args.people)], page_size
+            )
+        if parts == ["projects"]:
+            return paginate(
+                request, [self.project(i) for i in range(args.projects)], page_size
+            )
+        if len(parts) < 3 or parts[0] != "projects":
+            return None
+
+        project_id = int(parts[1])
+        if parts[2:] == ["audits"]:
+            return {
+                "Data": modified_since(
+                    request,
+                    [self.list_row(project_id * 1000 + i) for i in range(args.audits)],
+                )
+            }
+        if parts[2] == "audits" and len(parts) == 4:
+            return {"Data": self.audit(int(parts[3]))}
+        if parts[2:] == ["hse", "events"]:
+            return {
+                "Data": modified_since(
+                    request,
+                    [self.list_row(project_id * 1000 + i) for i in range(args.events)],
+                )
+            }
+        if parts[2:4] == ["hse", "events"] and len(parts) == 5:
+            return {"Data": self.hsevent(int(parts[4]))}
+        return None
+
+    def company(self, i):
+        return {
+            "Id": i,
+            "VendorCode": f"V{i}",
+            "Name": f"Company {i}",
+            "IsDeleted": False,
+        }
+
+    def location(self, country, i):
+        return {
+            "Id": country * 10000 + i,
+            "Country": {"Id": country, "Name": f"Country {country}"},
+            "Name": f"Location {i}",
+            "Longitude": 174.7,
+            "Latitude": -36.8,
+        }
+
+    def person(self, i):
+        return {
+            "Id": i,
+            "FirstName": "First",
+            "LastName": f"Last {i}",
+            "Company": {"Id": i % max(1, self.args.companies)},
+            "IsDeleted": False,
+            "AssignedProjects": [{"Id": i % max(1, self.args.projects)}],
+            "DateLastModified": modified(i),
+        }
+
+    def project(self, i):
+        return {
+            "Id": i,
+            "Name": f"Project {i}",
+            "Number": str(i),
+            "Status": "Archived" if i % 3 == 0 else "Active",
+            "DateLastModified": modified(i),
+        }
+
+    def list_row(self, i):
+        return {"Id": i, "Name": f"Item {i}", "DateLastModified": modified(i)}
+
+    def audit(self, i):
+        return {
+            "Id": i,
+            "Name": f"Audit {i}",
+            "DateCreated": modified(i),
+            "DateClosed": modified(i) if i % 2 else None,
+            "AuditedCompany": {"Id": i % max(1, self.args.companies)},
+            "Sections": [
+                {
+                    "Id": i * 10 + s,
+                    "Name": f"Section {s}",
+                    "Questions": [
+                        {
+                            "Id": i * 100 + s * 10 + q,
+                            "Name": f"Question {q}",
+                            "Answer": "Yes\nwith notes",
+                            "Comments": [
+                                {
+                                    "CommentText": 'Checked "twice"',
+                                    "CommentDate": modified(i),
+                                }
+                            ],
+                        }
+                        for q in range(3)
+                    ],
+                }
+                for s in range(2)
+            ],
+        }
+
+    def hsevent(self, i):
+        return {
+            "Id": i,
+            "Name": f"Event {i}",
+            "Description": "Slipped on a wet surface near the site entrance. " * 12,
+            "ActionTaken": "Area cordoned off\nSignage added",
+            "DateReported": modified(i),
+            "DateOccurred": modified(i),
+            "SeriousHarm": False,
+            "SubCategory": {
+                "Id": i % 7,
+                "Name": f"Subcategory {i % 7}",
+                "ParentCategory": {"Id": i % 3, "Name": f"Category {i % 3}"},
+            },
+        }
+
+
+def ssl_context(args):
+    if not args.certfile:
+        return None
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(args.certfile, args.keyfile)
+    return context
+
+
+def main():
+    args = parse_args()
+    simulator = Simulator(args)
+    web.run_app(simulator.app(), port=args.port, ssl_context=ssl_context(args))
+
+
+if __name__ == "__main__":
+    main()
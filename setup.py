@@ -20,7 +20,12 @@ setup(
             "pylint",
             "ipdb",
             "nose",
-        ]
+            "pytest",
+        ],
+        "fast": [
+            "orjson",
+            "ijson",
+        ],
     },
     entry_points="""
           [console_scripts]
@@ -1,13 +1,25 @@
 import os
 import json
 import asyncio
-import aiohttp
 import singer
 from singer import metadata
-
-from tap_acuite.utility import get_abs_path, initialise_semaphore
+from singer.bookmarks import get_bookmark
+
+from tap_acuite.utility import (
+    get_abs_path,
+    initialise_limiter,
+    initialise_settings,
+    initialise_cache,
+    create_session,
+)
 from tap_acuite.config import SYNC_FUNCTIONS, SUB_STREAMS
-from tap_acuite.fetch import write_bookmark
+from tap_acuite.fetch import write_bookmark, checkpoint
+from tap_acuite import utility
+from tap_acuite import output, metrics, render, references, fingerprints, planner
+from tap_acuite.catalog import CatalogIndex
+from tap_acuite.retries import initialise_retries, log_retries, retry_counts
+from tap_acuite.limiter import current_stream
+from tap_acuite.budget import BudgetExhausted, initialise_budget
 
 logger = singer.get_logger()
 
@@ -69,97 +81,109 @@ def do_discover():
     print(json.dumps(catalog, indent=2))
 
 
-def get_selected_streams(catalog):
-    """
-    Gets selected streams.  Checks schema's 'selected'
-    first -- and then checks metadata, looking for an empty
-    breadcrumb and mdata with a 'selected' entry
-    """
-    selected_streams = []
-    for stream in catalog["streams"]:
-        stream_metadata = stream["metadata"]
-        if stream["schema"].get("selected", False):
-            selected_streams.append(stream["tap_stream_id"])
-        else:
-            for entry in stream_metadata:
-                # stream metadata will have empty breadcrumb
-                if not entry["breadcrumb"] and entry["metadata"].get("selected", None):
-                    selected_streams.append(stream["tap_stream_id"])
-
-    return selected_streams
-
-
-def get_stream_from_catalog(stream_id, catalog):
-    for stream in catalog["streams"]:
-        if stream["tap_stream_id"] == stream_id:
-            return stream
-    return None
-
-
 async def do_sync(session, state, catalog):
-    selected_stream_ids = get_selected_streams(catalog)
+    index = CatalogIndex(catalog)
 
     # pipelinewise-target-redshift fails without this initial state message, per https://github.com/transferwise/pipelinewise-target-redshift/issues/69
-    singer.write_state(state)
+    output.write_state(state)
 
-    # sync streams in parallel
-    streams = []
+    # request-seconds used by each stream in previous runs, which set each stream's share of the concurrency limit
+    costs = get_bookmark(state, "scheduler", "costs") or {}
+    utility.limiter.set_costs(costs)
 
-    for stream in catalog["streams"]:
-        stream_id = stream["tap_stream_id"]
-        stream_schema = stream["schema"]
-        mdata = stream["metadata"]
+    # a stream's chain is itself and the sub-streams it syncs, and the most expensive chains are started first
+    def chain_cost(stream_id):
+        return sum(
+            costs.get(s, 0) for s in [stream_id, *SUB_STREAMS.get(stream_id, [])]
+        )
 
-        # if it is a "sub_stream", it will be sync'd by its parent
-        if not SYNC_FUNCTIONS.get(stream_id):
-            continue
+    # sync streams in parallel
+    streams = []
 
+    for stream_id in sorted(SYNC_FUNCTIONS, key=chain_cost, reverse=True):
+        sync_func = SYNC_FUNCTIONS[stream_id]
         # if stream is selected, write schema and sync
-        if stream_id in selected_stream_ids:
-            singer.write_schema(stream_id, stream_schema, stream["key_properties"])
-
-            # get sync function and any sub streams
-            sync_func = SYNC_FUNCTIONS[stream_id]
-            sub_stream_ids = SUB_STREAMS.get(stream_id, None)
-
-            # sync stream
-            if not sub_stream_ids:
-                streams.append(sync_func(session, stream_schema, state, mdata))
-
-            # handle streams with sub streams
-            else:
-                stream_schemas = {stream_id: stream_schema}
-
-                # get and write selected sub stream schemas
-                for sub_stream_id in sub_stream_ids:
-                    if sub_stream_id in selected_stream_ids:
-                        sub_stream = get_stream_from_catalog(sub_stream_id, catalog)
-                        stream_schemas[sub_stream_id] = sub_stream["schema"]
-                        singer.write_schema(
-                            sub_stream_id,
-                            sub_stream["schema"],
-                            sub_stream["key_properties"],
-                        )
-
-                # sync stream and its sub streams
-                streams.append(sync_func(session, stream_schemas, state, mdata))
-
-    streams_resolved = await asyncio.gather(*streams)
+        if stream_id not in index:
+            continue
 
-    # update bookmark by merging in all streams
-    for substream in streams_resolved:
-        for (resource, extraction_time) in substream:
-            state = write_bookmark(state, resource, extraction_time)
-    singer.write_state(state)
+        for schema_stream_id in [stream_id, *SUB_STREAMS.get(stream_id, [])]:
+            # sub streams are sync'd by their parent, if selected
+            stream = index.get(schema_stream_id)
+            if stream is not None:
+                output.write_schema(
+                    stream.tap_stream_id, stream.schema, stream.key_properties
+                )
+
+        streams.append((stream_id, sync_func(session, index, state)))
+
+    # update bookmarks as each stream finishes, rather than waiting for the slowest
+    async def sync_stream(stream_id, stream):
+        current_stream.set(stream_id)
+        for (resource, extraction_time) in await stream:
+            write_bookmark(state, resource, extraction_time)
+        checkpoint(state, force=True)
+
+    tasks = [
+        asyncio.ensure_future(sync_stream(stream_id, stream))
+        for stream_id, stream in streams
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except BudgetExhausted as e:
+        # state as of the last finished stream or project, which is where the next run picks up
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logger.warning("%s, stopping early", e)
+        output.write_state(state)
+        if fingerprints.store is not None:
+            fingerprints.store.commit()
+        return
+
+    # smoothed with previous runs, so one unusual run doesn't upset the next
+    for stream_id, cost in utility.limiter.costs.items():
+        if stream_id is not None:
+            previous = costs.get(stream_id)
+            costs[stream_id] = round(
+                cost if previous is None else (previous + cost) / 2, 3
+            )
+    singer.write_bookmark(state, "scheduler", "costs", costs)
+    output.write_state(state)
+
+    # only once the state covering them has been written
+    if fingerprints.store is not None:
+        fingerprints.store.commit()
 
 
 async def run_async(config, state, catalog):
-    auth_headers = {"AcuiteApiKey": config["api_key"]}
-    # default is 300s, which is excessive. Some endpoints are very slow and take 30s to return normally
-    timeout = aiohttp.ClientTimeout(total=90)
-    async with aiohttp.ClientSession(headers=auth_headers, timeout=timeout) as session:
-        initialise_semaphore()
-        await do_sync(session, state, catalog)
+    async with create_session(config) as session:
+        initialise_limiter(config)
+        initialise_settings(config)
+        initialise_retries(config)
+        initialise_cache(config)
+        output.initialise_output(config)
+        metrics.initialise_metrics()
+        render.initialise_executor(config, catalog)
+        references.initialise_references()
+        fingerprints.initialise_fingerprints(config)
+        initialise_budget(config)
+        try:
+            if config.get("dry_run"):
+                result = await planner.plan(session, CatalogIndex(catalog), state)
+                planner.write_plan(config.get("plan_file"), result)
+            else:
+                await do_sync(session, state, catalog)
+        finally:
+            render.shutdown_executor()
+            output.flush()
+            utility.limiter.log_limits(force=True)
+            log_retries()
+            if utility.response_cache:
+                utility.response_cache.save()
+                utility.response_cache.log_stats()
+            if fingerprints.store is not None:
+                fingerprints.store.log_stats()
+            metrics.report(config.get("metrics_file"), retry_counts)
 
 
 @singer.utils.handle_top_exception(logger)
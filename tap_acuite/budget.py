@@ -0,0 +1,134 @@
+import time
+import asyncio
+import contextvars
+
+
+class BudgetExhausted(Exception):
+    pass
+
+
+class Usage:
+    def __init__(self):
+        self.requests = 0
+
+
+# what the requests being made are for (e.g. a project), set by Admission and inherited by the tasks it starts
+current_usage = contextvars.ContextVar("current_usage", default=None)
+
+
+# Optional cap on the requests and seconds a run can use. Once it's used up no more requests are started, and the run
+# stops at its last checkpoint: only completed work is ever in state, so the next run carries on from there
+class Budget:
+    def __init__(self, max_requests=None, max_duration=None):
+        self.max_requests = max_requests
+        self.max_duration = max_duration
+        self.deadline = (
+            None if max_duration is None else time.monotonic() + max_duration
+        )
+        self.requests = 0
+
+    def spend(self):
+        if self.max_requests is not None and self.requests >= self.max_requests:
+            raise BudgetExhausted(f"Request budget of {self.max_requests} used up")
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise BudgetExhausted(f"Time budget of {self.max_duration}s used up")
+        self.requests += 1
+        usage = current_usage.get()
+        if usage is not None:
+            usage.requests += 1
+
+    # what's left, e.g. to share between project shards
+    def remaining_requests(self):
+        if self.max_requests is None:
+            return None
+        return max(0, self.max_requests - self.requests)
+
+    def remaining_duration(self):
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+
+# Starts units of work (e.g. projects) only while the request budget left is expected to cover them and every unit
+# already running. Otherwise units started together would share out what's left, none would finish, and the next run
+# would start the same ones again. A unit is expected to cost as much as the most expensive one so far, this run or
+# (through estimate) the last, and with nothing to go on units are started one at a time
+# Once the budget is used up no more are started, and check() stops the run when the running ones have finished
+class Admission:
+    def __init__(self, estimate=None):
+        self.estimate = estimate
+        self.largest = None
+        self.running = 0
+        self.closed = False
+        self.condition = asyncio.Condition()
+
+    def expected(self):
+        return max(self.estimate or 0, self.largest or 0)
+
+    def can_start(self, remaining):
+        if self.running == 0:
+            return True
+        expected = self.expected()
+        return bool(expected) and remaining >= expected * (self.running + 1)
+
+    # the estimate for the next run: this run's most expensive unit, if any finished
+    def observed(self):
+        return self.largest if self.largest is not None else self.estimate
+
+    # a Usage counting the unit's requests, or None if it can't be started
+    async def acquire(self):
+        async with self.condition:
+            while True:
+                remaining = budget.remaining_requests()
+                if self.closed or remaining == 0:
+                    self.closed = True
+                    return None
+                if remaining is None or self.can_start(remaining):
+                    break
+                await self.condition.wait()
+            self.running += 1
+        usage = Usage()
+        current_usage.set(usage)
+        return usage
+
+    async def release(self, usage, finished=True):
+        async with self.condition:
+            self.running -= 1
+            if finished:
+                self.largest = max(self.largest or 0, usage.requests)
+            self.condition.notify_all()
+
+    # wraps a run_pipeline fetch so each item waits to be admitted, and is skipped if it can't be
+    def wrap(self, fetch):
+        async def admitted(item):
+            usage = await self.acquire()
+            if usage is None:
+                return None
+            finished = False
+            try:
+                result = await fetch(item)
+                finished = True
+                return result
+            finally:
+                await self.release(usage, finished)
+
+        return admitted
+
+    def check(self):
+        if self.closed:
+            raise BudgetExhausted(
+                f"Request budget of {budget.max_requests} used up before every project started"
+            )
+
+
+budget = Budget()
+
+
+def initialise_budget(config):
+    global budget
+    max_requests = config.get("max_requests")
+    max_duration = config.get("max_duration")
+    budget = Budget(
+        None if max_requests is None else int(max_requests),
+        None if max_duration is None else float(max_duration),
+    )
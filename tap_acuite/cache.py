@@ -0,0 +1,140 @@
+import os
+import json
+import hashlib
+import singer
+from collections import OrderedDict
+
+logger = singer.get_logger()
+
+base_max_bytes = 512 * 1024 * 1024
+
+
+# Size-bounded on-disk cache of detail responses with least-recently-used eviction
+# The index is kept (and saved) in order of use, least recent first, so eviction takes from the front
+# An entry is served without a request while the item's DateLastModified from the list call still matches,
+# and otherwise its ETag/Last-Modified are sent so the API can answer 304 Not Modified
+class ResponseCache:
+    def __init__(self, directory, max_bytes=base_max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, "index.json")
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(self.index_path) as file:
+                self.index = OrderedDict(json.load(file))
+        except (OSError, ValueError):
+            self.index = OrderedDict()
+        self.size = sum(entry["size"] for entry in self.index.values())
+        self.remove_orphans()
+        # max_bytes may have been lowered since the last run
+        self.evict()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def key(self, url):
+        return hashlib.sha1(url.encode("utf-8")).hexdigest()
+
+    # files left behind by a run that stopped before saving the index
+    # subdirectories are left alone, as they hold the caches of project shards
+    def remove_orphans(self):
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            key = filename[: -len(".json")]
+            if (
+                filename != "index.json"
+                and key not in self.index
+                and os.path.isfile(path)
+            ):
+                os.remove(path)
+
+    def read(self, key):
+        try:
+            with open(self.path(key), "rb") as file:
+                body = file.read()
+        except OSError:
+            self.remove(key)
+            return None
+        self.index.move_to_end(key)
+        return body
+
+    # body if the cached response is for the same version of the item, otherwise None
+    def get(self, url, version):
+        key = self.key(url)
+        entry = self.index.get(key)
+        if version is None or entry is None or entry["version"] != version:
+            return None
+        body = self.read(key)
+        if body is not None:
+            self.hits += 1
+        return body
+
+    # headers for a conditional request, if an earlier response had validators
+    def validators(self, url):
+        entry = self.index.get(self.key(url))
+        headers = {}
+        if entry is None:
+            return headers
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    # the API confirmed (304) that the cached body is current
+    def revalidate(self, url, version):
+        key = self.key(url)
+        body = self.read(key) if key in self.index else None
+        if body is not None:
+            self.index[key]["version"] = version
+            self.revalidated += 1
+        return body
+
+    def put(self, url, version, body, etag=None, last_modified=None):
+        self.misses += 1
+        key = self.key(url)
+        if len(body) > self.max_bytes:
+            return
+        if key in self.index:
+            self.remove(key)
+        with open(self.path(key), "wb") as file:
+            file.write(body)
+        self.index[key] = {
+            "version": version,
+            "etag": etag,
+            "last_modified": last_modified,
+            "size": len(body),
+        }
+        self.size += len(body)
+        self.evict()
+
+    def remove(self, key):
+        entry = self.index.pop(key)
+        self.size -= entry["size"]
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        while self.size > self.max_bytes and self.index:
+            self.remove(next(iter(self.index)))
+
+    def save(self):
+        temp_path = self.index_path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self.index, file)
+        os.replace(temp_path, self.index_path)
+
+    def log_stats(self):
+        logger.info(
+            "Response cache: hits=%d revalidated=%d misses=%d size=%.1fMB",
+            self.hits,
+            self.revalidated,
+            self.misses,
+            self.size / 1024 / 1024,
+        )
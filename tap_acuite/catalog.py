@@ -0,0 +1,65 @@
+from singer import metadata
+
+from tap_acuite.transform import compile_transformer
+
+
+def get_selected_streams(catalog):
+    """
+    Gets selected streams.  Checks schema's 'selected'
+    first -- and then checks metadata, looking for an empty
+    breadcrumb and mdata with a 'selected' entry
+    """
+    selected_streams = []
+    for stream in catalog["streams"]:
+        stream_metadata = stream["metadata"]
+        if stream["schema"].get("selected", False):
+            selected_streams.append(stream["tap_stream_id"])
+        else:
+            for entry in stream_metadata:
+                # stream metadata will have empty breadcrumb
+                if not entry["breadcrumb"] and entry["metadata"].get("selected", None):
+                    selected_streams.append(stream["tap_stream_id"])
+
+    return selected_streams
+
+
+# Everything the sync needs to know about one stream, worked out once from its catalog entry
+class CatalogStream:
+    def __init__(self, entry):
+        self.tap_stream_id = entry["tap_stream_id"]
+        self.schema = entry["schema"]
+        self.key_properties = entry.get("key_properties", ["Id"])
+        self.mdata = metadata.to_map(entry["metadata"])
+        self.transform = compile_transformer(self.schema, self.mdata)
+
+        # fields that end up in records: in the schema, and either automatic or not deselected
+        self.selected_fields = set()
+        for field_name in self.schema.get("properties", {}):
+            field_mdata = self.mdata.get(("properties", field_name), {})
+            inclusion = field_mdata.get("inclusion")
+            if inclusion == "automatic" or (
+                inclusion != "unsupported" and field_mdata.get("selected") is not False
+            ):
+                self.selected_fields.add(field_name)
+
+
+# Built once per run so handlers never scan the raw catalog, and per-record work only touches precomputed lookups
+class CatalogIndex:
+    def __init__(self, catalog):
+        # kept so the index can be rebuilt in another process, as compiled transformers can't be pickled
+        self.catalog = catalog
+        selected = set(get_selected_streams(catalog))
+        self.streams = {
+            entry["tap_stream_id"]: CatalogStream(entry)
+            for entry in catalog["streams"]
+            if entry["tap_stream_id"] in selected
+        }
+
+    def __getitem__(self, stream_id):
+        return self.streams[stream_id]
+
+    def __contains__(self, stream_id):
+        return stream_id in self.streams
+
+    def get(self, stream_id):
+        return self.streams.get(stream_id)
@@ -1,107 +1,256 @@
 import json
+import time
 import asyncio
+from datetime import timedelta, timezone
 import singer
 from singer.bookmarks import get_bookmark
-from singer import metadata
 from tap_acuite.utility import (
     get_generic,
-    get_all,
+    get_cached,
+    iter_all,
+    run_pipeline,
+    get_profile,
+    since_params,
+    modified_since,
+    settings,
+    base_workers,
     format_date,
+    parse_date,
 )
+from tap_acuite import output, metrics, render, shards, fingerprints, budget
+from tap_acuite.limiter import current_stream
 
 logger = singer.get_logger()
 
+base_inactive_statuses = ["Archived", "Closed"]
+base_inactive_days = 7
+base_checkpoint_interval = 60
+last_checkpoint = time.monotonic()
 
-def handle_paginated(resource, url="", func=None):
-    extraction_time = singer.utils.now()
 
+def handle_paginated(resource, url="", func=None):
     if url == "":
         url = resource
 
-    async def get(session, schema, state, mdata):       
-        bookmark = get_bookmark(state, resource, "since")
-        qs = {} if bookmark is None else {"lastModifiedSince": bookmark}
-        if (resource == "locations"):
-            qs["countryId"] = 27
-            for row in await get_all(session, resource, url, qs):
-            # optional transform function
+    async def get(session, catalog, state):
+        extraction_time = singer.utils.now()
+        # e.g. locations are listed per country. Partitions are fetched concurrently, each with its own bookmark
+        partitions = get_profile(resource)["partitions"]
+        partition_bookmarks = get_partition_bookmarks(state, resource, partitions)
+        if partitions:
+            singer.write_bookmark(state, resource, "partitions", partition_bookmarks)
+
+        async def sync_partition(params):
+            key = partition_key(params)
+            if partitions:
+                bookmark = partition_bookmarks.get(key)
+            else:
+                bookmark = get_bookmark(state, resource, "since")
+            qs = {**since_params(resource, bookmark), **params}
+            # rows the API didn't filter by the bookmark are filtered here
+            server_filtered = "lastModifiedSince" in qs
+            async for row in iter_all(session, resource, url, qs):
+                if not server_filtered and not modified_since(row, bookmark):
+                    continue
+                # optional transform function
                 if func != None:
                     row = func(row)
-                write_record(row, resource, schema, mdata, extraction_time)
-            qs["countryId"] = 44
-        if (resource == "companies"):
-            qs["includeDeleted"] = True
-        for row in await get_all(session, resource, url, qs):
-            # optional transform function
-            if func != None:
-                row = func(row)
-
-            write_record(row, resource, schema, mdata, extraction_time)
+
+                write_record(row, catalog[resource], extraction_time)
+
+            if partitions:
+                # a finished partition's bookmark moves on without waiting for the others
+                partition_bookmarks[key] = format_date(extraction_time)
+                checkpoint(state)
+
+        await asyncio.gather(*[sync_partition(params) for params in partitions or [{}]])
         return [(resource, extraction_time)]
 
     return get
 
 
-async def handle_projects(session, schemas, state, mdata):
+def partition_key(params):
+    return "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+
+
+# State from before partitions had their own bookmarks only has the stream's, which covers every partition listed then
+# Once there are partition bookmarks, a partition without one has been added since, so it's synced from scratch
+def get_partition_bookmarks(state, resource, partitions):
+    partition_bookmarks = get_bookmark(state, resource, "partitions")
+    if partition_bookmarks is None:
+        since = get_bookmark(state, resource, "since")
+        partition_bookmarks = {}
+        if since is not None:
+            for params in partitions:
+                partition_bookmarks[partition_key(params)] = since
+    return partition_bookmarks
+
+
+async def handle_projects(session, catalog, state):
     extraction_time = singer.utils.now()
     resource = "projects"
     bookmark = get_bookmark(state, resource, "since")
     times = [("projects", extraction_time)]
 
-    rows = await get_all(session, "projects", "projects", {"includeArchived": "true"})
+    sub_streams = [s for s in ["audits", "hsevents"] if s in catalog]
+    # entries are replaced as each project completes, so checkpoints part way through the run only cover finished projects
+    index = get_bookmark(state, "project_index", "projects") or {}
+    if sub_streams:
+        singer.write_bookmark(state, "project_index", "projects", index)
+    seen_ids = set()
+
+    # sub-streams need every project, so the API can only filter by the bookmark when none are selected
+    qs = {} if sub_streams else since_params(resource, bookmark)
+
+    # only keep what's needed to decide on the sub-streams, rather than every project row
+    projects = []
+    async for project in iter_all(session, resource, resource, qs):
+        if sub_streams:
+            projects.append(
+                (project["Id"], project.get("DateLastModified"), project.get("Status"))
+            )
+            seen_ids.add(str(project["Id"]))
+
+        if qs or modified_since(project, bookmark):
+            write_record(project, catalog["projects"], extraction_time)
+
+    # with neither audits nor hsevents selected there's nothing to do per project, and the index is left alone
+    if not sub_streams:
+        return times
+
+    def finish_project(project_id, new_entry):
+        index[str(project_id)] = new_entry
+        checkpoint(state)
+
+    # left as-is when skipped, so the project's own bookmarks still cover the gap when it's next visited
+    to_sync = []
+    for project_id, modified, status in projects:
+        entry = index.get(str(project_id), {})
+        if project_needs_sync(entry, modified, status, sub_streams, extraction_time):
+            to_sync.append((project_id, modified, status, entry))
+    del projects
+
+    if int(settings.get("project_processes", 1)) > 1 and to_sync:
+        await shards.run_shards(
+            to_sync, catalog, state, extraction_time, finish_project
+        )
+    else:
 
-    # can't filter this in query string as we need all projects to pass to sub-streams. Has to be client-side filtering
-    # only using string sorting rather than date comparison, but ISO date format means that this works perfectly
-    filtered_projects = [
-        r for r in rows if (bookmark is None or r["DateLastModified"] >= bookmark)
-    ]
-    write_many(
-        filtered_projects, "projects", schemas["projects"], mdata, extraction_time
-    )
+        async def sync(project):
+            new_entry = await sync_project(
+                session, project, catalog, state, sub_streams, extraction_time
+            )
+            finish_project(project[0], new_entry)
+
+        # a fixed pool of project workers rather than a task per project
+        admission = budget.Admission(
+            get_bookmark(state, "scheduler", "project_requests")
+        )
+        try:
+            await run_pipeline(
+                to_sync,
+                admission.wrap(sync),
+                workers=settings.get("project_workers", base_workers),
+            )
+        finally:
+            save_project_estimate(state, admission.observed())
+        admission.check()
+
+    # projects that no longer exist drop out of the index, which can only be told when every project was listed
+    if not qs:
+        for project_id in set(index) - seen_ids:
+            del index[project_id]
+
+    if "audits" in catalog:
+        times.append(("audits", extraction_time))
+        if "audit_sections" in catalog:
+            times.append(("audit_sections", extraction_time))
+        if "audit_questions" in catalog:
+            times.append(("audit_questions", extraction_time))
+    if "hsevents" in catalog:
+        times.append(("hsevents", extraction_time))
+
+    return times
 
+
+# the most requests one project has taken, so the next run's request budget is shared out well from the start
+def save_project_estimate(state, requests):
+    if requests is not None:
+        singer.write_bookmark(state, "scheduler", "project_requests", requests)
+
+
+# Syncs one project's audits and hsevents, returning its new project index entry
+async def sync_project(session, project, catalog, state, sub_streams, extraction_time):
+    project_id, modified, status, entry = project
     subqueries = []
-    for project in rows:
-        if schemas.get("audits"):
-            subqueries.append(
-                handle_audits(
-                    session,
-                    project["Id"],
-                    schemas,
-                    state,
-                    mdata,
-                )
+    if "audits" in catalog:
+        subqueries.append(
+            handle_audits(
+                session,
+                project_id,
+                catalog,
+                state,
+                entry.get("audits") or get_bookmark(state, "audits", "since"),
             )
-            times.append(("audits", extraction_time))
-            if schemas.get("audit_sections"):
-                times.append(("audit_sections", extraction_time))
-            if schemas.get("audit_questions"):
-                times.append(("audit_questions", extraction_time))
-        if schemas.get("hsevents"):
-            subqueries.append(
-                handle_hsevents(session, project["Id"], schemas, state, mdata)
+        )
+    if "hsevents" in catalog:
+        subqueries.append(
+            handle_hsevents(
+                session,
+                project_id,
+                catalog,
+                state,
+                entry.get("hsevents") or get_bookmark(state, "hsevents", "since"),
             )
-            times.append(("hsevents", extraction_time))
+        )
     await asyncio.gather(*subqueries)
 
-    return times
+    synced = format_date(extraction_time)
+    return {
+        **entry,
+        **{s: synced for s in sub_streams},
+        "modified": modified,
+        "status": status,
+    }
 
 
-async def handle_people(session, schemas, state, mdata):
+# Archived and closed projects rarely change, so unless the project itself has been modified their audits and
+# hsevents are only re-checked every inactive_project_days rather than on every run
+def project_needs_sync(entry, modified, status, sub_streams, extraction_time):
+    inactive_statuses = settings.get(
+        "inactive_project_statuses", base_inactive_statuses
+    )
+    if status not in inactive_statuses:
+        return True
+    if entry.get("modified") != modified:
+        return True
+    synced = [entry.get(s) for s in sub_streams]
+    # a sub-stream that has never been synced for this project (e.g. newly selected) needs a full sync
+    if None in synced:
+        return True
+    interval = timedelta(
+        days=float(settings.get("inactive_project_days", base_inactive_days))
+    )
+    last_synced = parse_date(min(synced)).replace(tzinfo=timezone.utc)
+    return extraction_time - last_synced >= interval
+
+
+async def handle_people(session, catalog, state):
     extraction_time = singer.utils.now()
     resource = "people"
     url = resource
-    sync_people_projects = "people_projects" in schemas
+    sync_people_projects = "people_projects" in catalog
     bookmark = get_bookmark(state, resource, "since")
-    qs = {"includeDeleted": "true"}
-    if bookmark is not None:
-        qs["lastModifiedSince"] = bookmark
+    qs = since_params(resource, bookmark)
 
     times = [(resource, extraction_time)]
     if sync_people_projects:
         times.append(("people_projects", extraction_time))
 
-    for row in await get_all(session, resource, url, qs):
-        write_record(row, resource, schemas[resource], mdata, extraction_time)
+    async for row in iter_all(session, resource, url, qs):
+        if not qs and not modified_since(row, bookmark):
+            continue
+        write_record(row, catalog[resource], extraction_time)
 
         if sync_people_projects:
             for p in row["AssignedProjects"]:
@@ -116,139 +265,220 @@ async def handle_people(session, schemas, state, mdata):
                     or record["project_id"] is None
                 ):
                     continue
-                write_record(
-                    record,
-                    "people_projects",
-                    schemas["people_projects"],
-                    mdata,
-                    extraction_time,
-                )
+                write_record(record, catalog["people_projects"], extraction_time)
 
     return times
 
 
-async def handle_hsevents(session, project_id, schemas, state, mdata):
+async def handle_hsevents(session, project_id, catalog, state, bookmark):
     url = f"projects/{project_id}/hse/events"
     resource = "hsevents"
     extraction_time = singer.utils.now()
+    # runs in its own task, so requests from here on count towards hsevents rather than projects
+    current_stream.set(resource)
 
-    sync_categories = schemas.get("categories")
-    sync_subcategories = schemas.get("subcategories")
-    categories_ids = set() if sync_categories else None
-    subcategories_ids = set() if sync_subcategories else None
-
-    bookmark = get_bookmark(state, resource, "since")
-    qs = {} if bookmark is None else {"lastModifiedSince": bookmark}
-    res = await get_generic(session, "hsevents", url, qs)
-    # immediately discard everything except the ID to minimise memory footprint (could be holding this array for a while)
-    row_ids = [row["Id"] for row in res["Data"]]
-
-    columns_to_trim = [
-        "Description",
-        "PreventativeAction",
-        "ActionTaken",
-        "WeatherConditions",
+    # qs is only the incremental filter, so also says whether the API has already filtered the rows
+    qs = since_params(resource, bookmark)
+    res = await get_generic(
+        session, resource, url, {**get_profile(resource)["params"], **qs}
+    )
+    fields = required_fields(resource, catalog)
+    # category and subcategory records are shared between events and projects, so only the first of each is written
+    renderer = render.Renderer(catalog, prepare_hsevent, extraction_time)
+
+    if not needs_detail(resource, fields):
+        for row in res["Data"]:
+            if qs or modified_since(row, bookmark):
+                await renderer.add(keep_fields(row, fields), project_id)
+        await renderer.drain()
+        return
+
+    # immediately discard everything except the ID and version to minimise memory footprint (could be holding this array for a while)
+    rows = [
+        (row["Id"], row.get("DateLastModified"))
+        for row in res["Data"]
+        if qs or modified_since(row, bookmark)
     ]
+    del res
+
+    async def get_detail(row):
+        id, version = row
+        r = await get_cached(session, "hsevents", f"{url}/{id}", version)
+        return keep_fields(r["Data"], fields)
+
+    # detail workers feed a single write stage, so the number of in-flight requests and response bodies is bounded
+    await run_pipeline(
+        rows,
+        get_detail,
+        lambda row: renderer.add(row, project_id),
+        workers=settings.get("detail_workers", base_workers),
+    )
+    await renderer.drain()
+
+
+hsevent_columns_to_trim = [
+    "Description",
+    "PreventativeAction",
+    "ActionTaken",
+    "WeatherConditions",
+]
+
+
+# do all processing at the row level, returning the (stream, record) pairs to write
+# plain data in and out, so it can run in a transform executor
+def prepare_hsevent(row, catalog, project_id):
+    # Project ID isn't returned in the record, so add it
+    row["ProjectId"] = project_id
+
+    # keep only first 500 characters of these columns as they aren't needed for reporting, take up space in Redshift, and Redshift tops out at 1k characters
+    # need to trim before JSON-encoding as trimming a JSON-encoded string will leave a string that's not valid JSON
+    for col in hsevent_columns_to_trim:
+        if row.get(col) and len(row[col]) > 500:
+            row[col] = row[col][:500] + "..."
+
+    # See https://www.notion.so/fosters/pipelinewise-target-redshift-strips-newlines-f937185a6aec439dbbdae0e9703f834b
+    columns_with_special_characters = ["Description", "ActionTaken"]
+    for col in columns_with_special_characters:
+        if row.get(col):
+            row[col] = json.dumps(row[col])
 
-    # do all processing at the row level, including writing records one at a time
-    # this should minimise memory usage
-    async def get_detail(id):
-        r = await get_generic(session, "hsevents", f"{url}/{id}")
-        row = r["Data"]
-        # Project ID isn't returned in the record, so add it
-        row["ProjectId"] = project_id
-
-        # keep only first 500 characters of these columns as they aren't needed for reporting, take up space in Redshift, and Redshift tops out at 1k characters
-        # need to trim before JSON-encoding as trimming a JSON-encoded string will leave a string that's not valid JSON
-        for col in columns_to_trim:
-            if row.get(col) and len(row[col]) > 500:
-                row[col] = row[col][:500] + "..."
-
-        # See https://www.notion.so/fosters/pipelinewise-target-redshift-strips-newlines-f937185a6aec439dbbdae0e9703f834b
-        columns_with_special_characters = ["Description", "ActionTaken"]
-        for col in columns_with_special_characters:
-            if row.get(col):
-                row[col] = json.dumps(row[col])
-
-        write_record(row, "hsevents", schemas["hsevents"], mdata, extraction_time)
-
-        if sync_categories:
-            c = row["SubCategory"]["ParentCategory"]
-            if c["Id"] not in categories_ids:
-                categories_ids.add(c["Id"])
-                write_record(
-                    c, "categories", schemas["categories"], mdata, extraction_time
-                )
-        if sync_subcategories:
-            s = row["SubCategory"]
-            if s["Id"] not in subcategories_ids:
-                subcategories_ids.add(s["Id"])
-                write_record(
-                    s, "subcategories", schemas["subcategories"], mdata, extraction_time
-                )
-
-    await asyncio.gather(*[get_detail(id) for id in row_ids])
+    records = [("hsevents", row)]
+    if "categories" in catalog:
+        records.append(("categories", row["SubCategory"]["ParentCategory"]))
+    if "subcategories" in catalog:
+        records.append(("subcategories", row["SubCategory"]))
+    return records
 
 
 # once closed, can't be edited (unless Acuite unlocks it), so safe to stop syncing
-async def handle_audits(session, project_id, schemas, state, mdata):
+async def handle_audits(session, project_id, catalog, state, bookmark):
     url = f"projects/{project_id}/audits"
     resource = "audits"
     extraction_time = singer.utils.now()
+    current_stream.set(resource)
 
-    sync_sections = "audit_sections" in schemas
-    sync_questions = "audit_questions" in schemas
-    sync_comments = "audit_question_comments" in schemas
+    qs = since_params(resource, bookmark)
+    res = await get_generic(
+        session, resource, url, {**get_profile(resource)["params"], **qs}
+    )
+    fields = required_fields(resource, catalog)
+    renderer = render.Renderer(catalog, prepare_audit, extraction_time)
+
+    if not needs_detail(resource, fields):
+        for row in res["Data"]:
+            if qs or modified_since(row, bookmark):
+                await renderer.add(keep_fields(row, fields), project_id)
+        await renderer.drain()
+        return
+
+    rows = [
+        (row["Id"], row.get("DateLastModified"))
+        for row in res["Data"]
+        if qs or modified_since(row, bookmark)
+    ]
+    del res
+
+    async def get_detail(row):
+        id, version = row
+        r = await get_cached(session, resource, f"{url}/{id}", version)
+        return keep_fields(r["Data"], fields)
+
+    # fetched concurrently, but written in list order so output is deterministic
+    await run_pipeline(
+        rows,
+        get_detail,
+        lambda detail: renderer.add(detail, project_id),
+        workers=settings.get("audit_workers", base_workers),
+        ordered=True,
+    )
+    await renderer.drain()
+
+
+# sections, questions and comments are written straight after their audit
+def prepare_audit(detail, catalog, project_id):
+    detail["ProjectId"] = project_id
+
+    if detail.get("AuditedCompany"):
+        detail["AuditedCompanyId"] = detail["AuditedCompany"]["Id"]
+
+    records = [("audits", detail)]
+
+    if "audit_sections" in catalog:
+        for section in detail["Sections"]:
+            section["audit_id"] = detail["Id"]
+            records.append(("audit_sections", section))
+
+    if "audit_questions" in catalog:
+        sync_comments = "audit_question_comments" in catalog
+        for section in detail["Sections"]:
+            for q in section["Questions"]:
+                q["audit_id"] = detail["Id"]
+                q["section_id"] = section["Id"]
+                if q.get("Answer"):
+                    # Redshift has max length 1k characters
+                    # see https://www.notion.so/fosters/pipelinewise-target-redshift-strips-newlines-f937185a6aec439dbbdae0e9703f834b
+                    q["Answer"] = json.dumps(q["Answer"][:750])
+                records.append(("audit_questions", q))
+
+                if sync_comments and q.get("Comments"):
+                    for (i, c) in enumerate(q["Comments"]):
+                        c["Id"] = str(q["Id"]) + "_" + str(i)
+                        c["QuestionId"] = q["Id"]
+                        # could have special characters
+                        c["CommentText"] = json.dumps(c["CommentText"])
+                        records.append(("audit_question_comments", c))
+
+    return records
+
+
+# fields the tap fills in itself, and the API fields they're made from
+derived_fields = {
+    "audits": {"ProjectId": [], "AuditedCompanyId": ["AuditedCompany"]},
+    "hsevents": {"ProjectId": []},
+}
+# sub-streams made from a nested part of their parent's detail response
+nested_sub_streams = {
+    "audits": {
+        "audit_sections": "Sections",
+        "audit_questions": "Sections",
+        "audit_question_comments": "Sections",
+    },
+    "hsevents": {"categories": "SubCategory", "subcategories": "SubCategory"},
+}
+# fields known to be in list responses, overridable with "list_fields" once checked against the API
+base_list_fields = {
+    "audits": ["Id", "DateLastModified"],
+    "hsevents": ["Id", "DateLastModified"],
+}
+
+
+# the API fields needed for a stream's selected fields and sub-streams
+def required_fields(resource, catalog):
+    fields = set()
+    for field in catalog[resource].selected_fields:
+        fields.update(derived_fields[resource].get(field, [field]))
+    for sub_stream, field in nested_sub_streams[resource].items():
+        if sub_stream in catalog:
+            fields.add(field)
+    return fields
+
+
+# if the list response already has everything, the detail request for each item can be skipped
+def needs_detail(resource, fields):
+    list_fields = settings.get("list_fields", {}).get(
+        resource, base_list_fields[resource]
+    )
+    return not fields <= set(list_fields)
 
-    bookmark = get_bookmark(state, resource, "since")
-    qs = {} if bookmark is None else {"lastModifiedSince": bookmark}
-    r = await get_generic(session, resource, url, qs)
 
-    for row in r["Data"]:
-        detail = await get_generic(session, resource, f"{url}/{row['Id']}")
-        detail = detail["Data"]
-        detail["ProjectId"] = project_id
-
-        if detail.get("AuditedCompany"):
-            detail["AuditedCompanyId"] = detail["AuditedCompany"]["Id"]
-
-        # write audit
-        write_record(detail, resource, schemas[resource], mdata, extraction_time)
-
-        if sync_sections:
-            r = "audit_sections"
-            for section in detail["Sections"]:
-                section["audit_id"] = detail["Id"]
-                write_record(section, r, schemas[r], mdata, extraction_time)
-
-        if sync_questions:
-            r = "audit_questions"
-            for section in detail["Sections"]:
-                for q in section["Questions"]:
-                    q["audit_id"] = detail["Id"]
-                    q["section_id"] = section["Id"]
-                    if q.get("Answer"):
-                        # Redshift has max length 1k characters
-                        # see https://www.notion.so/fosters/pipelinewise-target-redshift-strips-newlines-f937185a6aec439dbbdae0e9703f834b
-                        q["Answer"] = json.dumps(q["Answer"][:750])
-                    write_record(q, r, schemas[r], mdata, extraction_time)
-
-                    if sync_comments and q.get("Comments"):
-                        for (i, c) in enumerate(q["Comments"]):
-                            c["Id"] = str(q["Id"]) + "_" + str(i)
-                            c["QuestionId"] = q["Id"]
-                            # could have special characters
-                            c["CommentText"] = json.dumps(c["CommentText"])
-                            write_record(
-                                c,
-                                "audit_question_comments",
-                                schemas["audit_question_comments"],
-                                mdata,
-                                extraction_time,
-                            )
-
-
-async def handle_detailed(session, resource, url, schemas, state, mdata):
+# drops anything unselected (e.g. a large nested structure) before it's held in a queue or sent to a transform executor
+def keep_fields(row, fields):
+    for key in [key for key in row if key not in fields]:
+        del row[key]
+    return row
+
+
+async def handle_detailed(session, resource, url, catalog, state):
     extraction_time = singer.utils.now()
     bookmark = get_bookmark(state, resource, "since")
     qs = {} if bookmark is None else {"lastModifiedSince": bookmark}
@@ -256,23 +486,43 @@ async def handle_detailed(session, resource, url, schemas, state, mdata):
 
     for row in r["Data"]:
         detail = await get_generic(session, resource, f"{url}/{row['Id']}")
-        write_record(
-            detail["Data"], resource, schemas[resource], mdata, extraction_time
-        )
+        write_record(detail["Data"], catalog[resource], extraction_time)
 
     return [(resource, extraction_time)]
 
 
 # More convenient to use but has to all be held in memory, so use write_record instead for resources with many rows
-def write_many(rows, resource, schema, mdata, dt):
+def write_many(rows, stream, dt):
     for row in rows:
-        write_record(row, resource, schema, mdata, dt)
+        write_record(row, stream, dt)
+
+
+# stream is the CatalogStream for the record's stream, with its transformer already compiled
+# with a fingerprint store, records identical to what was sent in an earlier run are dropped
+def write_record(row, stream, dt):
+    start = time.perf_counter()
+    rec = stream.transform(row)
+    transformed = time.perf_counter()
+    body = output.encode(rec)
+    if fingerprints.store is not None and not fingerprints.store.is_changed(
+        stream.tap_stream_id, rec.get("Id"), fingerprints.digest(body)
+    ):
+        return
+    output.write_encoded_record(stream.tap_stream_id, body, time_extracted=dt)
+    metrics.record_write(
+        stream.tap_stream_id, transformed - start, time.perf_counter() - transformed
+    )
 
 
-def write_record(row, resource, schema, mdata, dt):
-    with singer.Transformer() as transformer:
-        rec = transformer.transform(row, schema, metadata=metadata.to_map(mdata))
-    singer.write_record(resource, rec, time_extracted=dt)
+# Periodically writes state during the sync so a failed run can resume near where it stopped
+# Only bookmarks for completed work (whole streams, or whole projects in the project index) are ever in state
+def checkpoint(state, force=False):
+    global last_checkpoint
+    interval = float(settings.get("checkpoint_interval", base_checkpoint_interval))
+    now = time.monotonic()
+    if force or now - last_checkpoint >= interval:
+        last_checkpoint = now
+        output.write_state(state)
 
 
 def write_bookmark(state, resource, dt):
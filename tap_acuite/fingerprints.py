@@ -0,0 +1,71 @@
+import os
+import json
+import hashlib
+import singer
+
+logger = singer.get_logger()
+
+
+# Content hashes of the records already sent to the target, keyed by stream and Id, so byte-identical records can be
+# left out of later runs
+# Hashes from this run are only committed once its final state has been written, so records from a run that fails
+# part way are sent again next time
+class FingerprintStore:
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as file:
+                self.committed = json.load(file)
+        except (OSError, ValueError):
+            self.committed = {}
+        self.pending = {}
+        self.suppressed = 0
+        self.changed = 0
+
+    # False if the record is identical to the last one committed for its key
+    def is_changed(self, stream, key, digest):
+        key = str(key)
+        if self.committed.get(stream, {}).get(key) == digest:
+            self.suppressed += 1
+            return False
+        self.pending.setdefault(stream, {})[key] = digest
+        self.changed += 1
+        return True
+
+    # digests from another process (a project shard) that were written in this run
+    def merge(self, pending):
+        for stream, digests in pending.items():
+            self.pending.setdefault(stream, {}).update(digests)
+
+    def commit(self):
+        for stream, digests in self.pending.items():
+            self.committed.setdefault(stream, {}).update(digests)
+        self.pending = {}
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump(self.committed, file, separators=(",", ":"))
+        os.replace(temp_path, self.path)
+
+    def log_stats(self):
+        logger.info(
+            "Fingerprints: unchanged records suppressed=%d written=%d",
+            self.suppressed,
+            self.changed,
+        )
+
+
+store = None
+
+
+# only enabled when a fingerprint_file is configured
+def initialise_fingerprints(config):
+    global store
+    if config.get("fingerprint_file"):
+        store = FingerprintStore(config["fingerprint_file"])
+    else:
+        store = None
+
+
+# of an encoded record, without its framing or time_extracted
+def digest(body):
+    return hashlib.blake2b(body, digest_size=8).hexdigest()
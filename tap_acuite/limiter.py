@@ -0,0 +1,223 @@
+import re
+import time
+import asyncio
+import contextvars
+from collections import defaultdict
+import singer
+
+logger = singer.get_logger()
+
+# defaults, all overridable from config
+base_max_concurrency = 32
+base_initial_concurrency = 8
+# a family is considered congested once its recent latency drifts this far above its longer-run baseline
+base_latency_tolerance = 2.0
+# weights of the latest request in the recent latency and in the baseline, which moves much more slowly so that
+# endpoints whose response times vary with the size of what's asked for (e.g. audits per project) aren't mistaken
+# for congested ones
+recent_weight = 0.2
+baseline_weight = 0.01
+# latencies below this are treated as equal, so tiny fluctuations on fast endpoints don't register
+latency_floor = 0.05
+base_log_interval = 60
+
+numeric_segment = re.compile(r"/\d+(?=/|$)")
+
+# the stream a request is made for, set by whatever is syncing it and inherited by the tasks it starts
+current_stream = contextvars.ContextVar("current_stream", default=None)
+
+
+# groups URLs into endpoint families, e.g. projects/123/hse/events/456 -> projects/{id}/hse/events/{id}
+def endpoint_family(url):
+    return numeric_segment.sub("/{id}", url.split("?")[0])
+
+
+def ewma(average, value, weight):
+    return value if average is None else (1 - weight) * average + weight * value
+
+
+class Family:
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = float(limit)
+        self.in_flight = 0
+        self.latency = None
+        self.baseline_latency = None
+        self.paused_until = 0
+        self.last_decrease = 0
+        self.successes = 0
+        self.failures = 0
+        self.throttles = 0
+
+
+# AIMD concurrency limiter, tracked per endpoint family under a global cap
+# Successes at normal latency grow a family's limit by one per window, failures and throttling halve it
+# Under the global cap, slots are shared between streams in proportion to their expected cost (see set_costs)
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        maximum=base_max_concurrency,
+        initial=base_initial_concurrency,
+        latency_tolerance=base_latency_tolerance,
+        log_interval=base_log_interval,
+    ):
+        self.maximum = maximum
+        self.initial = min(initial, maximum)
+        self.latency_tolerance = latency_tolerance
+        self.log_interval = log_interval
+        self.families = {}
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+        self.last_log = time.monotonic()
+        # per stream: share of the global cap, requests in flight, requests waiting only on the global cap,
+        # and request-seconds used this run
+        self.shares = {}
+        self.default_share = 1.0
+        self.stream_in_flight = defaultdict(int)
+        self.ready = defaultdict(int)
+        self.costs = defaultdict(float)
+
+    # costs are request-seconds per stream from previous runs, so each stream's share is its fraction of the total
+    # streams with no history (or hardly any) get the average share, so are never starved
+    def set_costs(self, costs):
+        total = sum(costs.values())
+        if not total:
+            self.shares = {}
+            self.default_share = 1.0
+            return
+        self.shares = {stream: cost / total for stream, cost in costs.items()}
+        self.default_share = 1 / len(costs)
+
+    # request-seconds used in another process, e.g. a project shard
+    def add_costs(self, costs):
+        for stream, cost in costs.items():
+            self.costs[stream] += cost
+
+    def share(self, stream):
+        return max(self.shares.get(stream, self.default_share), 0.01)
+
+    # lowest use of its share goes first, with ties going to the stream with the larger share
+    def usage(self, stream):
+        share = self.share(stream)
+        return (self.stream_in_flight[stream] / share, -share)
+
+    # only streams with a request that could otherwise go are considered, so a free slot is never held back for a
+    # stream that can't use it
+    def is_turn(self, stream):
+        mine = self.usage(stream)
+        return all(
+            mine <= self.usage(other)
+            for other, waiting in self.ready.items()
+            if waiting and other != stream
+        )
+
+    def get_family(self, name):
+        family = self.families.get(name)
+        if family is None:
+            family = Family(name, self.initial)
+            self.families[name] = family
+        return family
+
+    async def acquire(self, name):
+        family = self.get_family(name)
+        stream = current_stream.get()
+        async with self.condition:
+            while True:
+                pause = family.paused_until - time.monotonic()
+                if pause > 0:
+                    # throttled by the API, so wait out Retry-After (or an earlier wake-up) before rechecking
+                    try:
+                        await asyncio.wait_for(self.condition.wait(), pause)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                if family.in_flight >= int(family.limit):
+                    await self.condition.wait()
+                    continue
+                if self.in_flight < self.maximum and self.is_turn(stream):
+                    break
+                self.ready[stream] += 1
+                try:
+                    await self.condition.wait()
+                except asyncio.CancelledError:
+                    # it may have been holding up another stream's turn
+                    self.ready[stream] -= 1
+                    self.condition.notify_all()
+                    raise
+                self.ready[stream] -= 1
+            family.in_flight += 1
+            self.in_flight += 1
+            self.stream_in_flight[stream] += 1
+            # taking a slot can make it another stream's turn for any that are left
+            if self.in_flight < self.maximum:
+                self.condition.notify_all()
+
+    # outcome is "ok", "failed" (5xx, timeout, connection error), "throttled" (429) or None to leave the limit alone
+    async def release(self, name, latency, outcome, retry_after=None):
+        family = self.get_family(name)
+        stream = current_stream.get()
+        async with self.condition:
+            family.in_flight -= 1
+            self.in_flight -= 1
+            self.stream_in_flight[stream] -= 1
+            self.costs[stream] += latency
+            if outcome == "ok":
+                self.on_success(family, latency)
+            elif outcome == "failed":
+                family.failures += 1
+                self.decrease(family, 0.5)
+            elif outcome == "throttled":
+                family.throttles += 1
+                self.decrease(family, 0.5, force=True)
+                family.paused_until = max(
+                    family.paused_until, time.monotonic() + (retry_after or 1)
+                )
+            self.condition.notify_all()
+        self.log_limits()
+
+    def on_success(self, family, latency):
+        family.successes += 1
+        family.latency = ewma(family.latency, latency, recent_weight)
+        family.baseline_latency = ewma(
+            family.baseline_latency, latency, baseline_weight
+        )
+        if family.latency > self.latency_tolerance * max(
+            family.baseline_latency, latency_floor
+        ):
+            self.decrease(family, 0.9)
+        else:
+            # additive increase: a full window of successes adds one slot
+            family.limit = min(self.maximum, family.limit + 1 / family.limit)
+
+    def decrease(self, family, factor, force=False):
+        now = time.monotonic()
+        # requests that were already in flight report the same congestion, so only back off once per latency window
+        if not force and now - family.last_decrease < (family.latency or 1):
+            return
+        family.last_decrease = now
+        previous = int(family.limit)
+        family.limit = max(1.0, family.limit * factor)
+        if int(family.limit) != previous:
+            logger.debug(
+                "Concurrency for %s reduced from %d to %d",
+                family.name,
+                previous,
+                int(family.limit),
+            )
+
+    def log_limits(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_log < self.log_interval:
+            return
+        self.last_log = now
+        for family in sorted(self.families.values(), key=lambda f: f.name):
+            logger.info(
+                "Concurrency %s: limit=%d in_flight=%d avg_latency=%.2fs ok=%d failed=%d throttled=%d",
+                family.name,
+                int(family.limit),
+                family.in_flight,
+                family.latency or 0,
+                family.successes,
+                family.failures,
+                family.throttles,
+            )
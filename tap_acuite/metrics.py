@@ -0,0 +1,178 @@
+import json
+import time
+import bisect
+import singer
+from collections import defaultdict
+from singer.metrics import Point, log
+
+logger = singer.get_logger()
+
+# upper bounds in seconds for the request latency histogram, the last bucket catches everything slower
+latency_buckets = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+class EndpointMetrics:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.latency = 0.0
+        self.wait = 0.0
+        self.histogram = [0] * (len(latency_buckets) + 1)
+
+    def summary(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "latency_total": round(self.latency, 3),
+            "latency_mean": round(self.latency / self.requests, 3)
+            if self.requests
+            else 0,
+            "limiter_wait_total": round(self.wait, 3),
+            "latency_histogram": {
+                ("le_" + str(bound) if i < len(latency_buckets) else "inf"): count
+                for i, (bound, count) in enumerate(
+                    zip(latency_buckets + [None], self.histogram)
+                )
+            },
+        }
+
+    def merge(self, other):
+        self.requests += other["requests"]
+        self.errors += other["errors"]
+        self.bytes += other["bytes"]
+        self.latency += other["latency"]
+        self.wait += other["wait"]
+        self.histogram = [a + b for a, b in zip(self.histogram, other["histogram"])]
+
+
+class StreamMetrics:
+    def __init__(self):
+        self.records = 0
+        self.transform = 0.0
+        self.serialize = 0.0
+        self.first = None
+        self.last = None
+
+    def summary(self):
+        elapsed = (self.last - self.first) if self.records else 0
+        return {
+            "records": self.records,
+            "records_per_second": round(self.records / elapsed, 1) if elapsed else None,
+            "transform_seconds": round(self.transform, 3),
+            "serialize_seconds": round(self.serialize, 3),
+        }
+
+    # monotonic time is system-wide, so first and last compare across processes
+    def merge(self, other):
+        if not other["records"]:
+            return
+        self.first = (
+            other["first"] if self.first is None else min(self.first, other["first"])
+        )
+        self.last = (
+            other["last"] if self.last is None else max(self.last, other["last"])
+        )
+        self.records += other["records"]
+        self.transform += other["transform"]
+        self.serialize += other["serialize"]
+
+
+endpoints = defaultdict(EndpointMetrics)
+streams = defaultdict(StreamMetrics)
+started = time.monotonic()
+
+
+def initialise_metrics():
+    global started
+    endpoints.clear()
+    streams.clear()
+    started = time.monotonic()
+
+
+# failed requests (including those that will be retried) are counted, with latency up to the failure
+def record_request(family, latency, wait, size, failed=False):
+    endpoint = endpoints[family]
+    endpoint.requests += 1
+    endpoint.errors += failed
+    endpoint.bytes += size
+    endpoint.latency += latency
+    endpoint.wait += wait
+    endpoint.histogram[bisect.bisect_left(latency_buckets, latency)] += 1
+
+
+# the raw counters, for sending from a project shard to the main process
+def export():
+    return {
+        "endpoints": {family: vars(endpoint) for family, endpoint in endpoints.items()},
+        "streams": {stream_id: vars(stream) for stream_id, stream in streams.items()},
+    }
+
+
+# adds counters exported from another process, so they're reported with this one's
+def merge(exported):
+    for family, endpoint in exported["endpoints"].items():
+        endpoints[family].merge(endpoint)
+    for stream_id, stream in exported["streams"].items():
+        streams[stream_id].merge(stream)
+
+
+def record_write(stream_id, transform, serialize):
+    stream = streams[stream_id]
+    now = time.monotonic()
+    if stream.first is None:
+        stream.first = now
+    stream.last = now
+    stream.records += 1
+    stream.transform += transform
+    stream.serialize += serialize
+
+
+def summary(retry_counts=None):
+    return {
+        "duration_seconds": round(time.monotonic() - started, 3),
+        "endpoints": {
+            family: {
+                **endpoint.summary(),
+                "retries": (retry_counts or {}).get(family, 0),
+            }
+            for family, endpoint in sorted(endpoints.items())
+        },
+        "streams": {
+            stream_id: stream.summary() for stream_id, stream in sorted(streams.items())
+        },
+    }
+
+
+# emitted as singer METRIC log lines, and optionally written to a JSON file
+def report(metrics_file=None, retry_counts=None):
+    result = summary(retry_counts)
+    for family, endpoint in result["endpoints"].items():
+        tags = {"endpoint": family}
+        log(logger, Point("counter", "http_request_count", endpoint["requests"], tags))
+        log(logger, Point("counter", "http_request_errors", endpoint["errors"], tags))
+        log(logger, Point("counter", "http_request_retries", endpoint["retries"], tags))
+        log(logger, Point("counter", "http_response_bytes", endpoint["bytes"], tags))
+        log(
+            logger,
+            Point("timer", "http_request_duration", endpoint["latency_total"], tags),
+        )
+        log(
+            logger, Point("timer", "limiter_wait", endpoint["limiter_wait_total"], tags)
+        )
+    for stream_id, stream in result["streams"].items():
+        tags = {"stream": stream_id}
+        log(logger, Point("counter", "record_count", stream["records"], tags))
+        log(
+            logger,
+            Point("timer", "transform_duration", stream["transform_seconds"], tags),
+        )
+        log(
+            logger,
+            Point("timer", "serialize_duration", stream["serialize_seconds"], tags),
+        )
+
+    if metrics_file:
+        with open(metrics_file, "w") as file:
+            json.dump(result, file, indent=2)
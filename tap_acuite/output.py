@@ -0,0 +1,116 @@
+import sys
+import pytz
+import simplejson
+import singer
+from singer.utils import strftime
+
+# orjson is optional but several times faster than simplejson for encoding records
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+default_buffer_size = 1024 * 1024
+
+buffer = bytearray()
+buffer_size = default_buffer_size
+# where flushed output goes if not stdout, e.g. a project shard sending its output to the parent process
+sink = None
+# cached message framing, as every record in a stream shares the same prefix and (per extraction time) suffix
+record_prefixes = {}
+record_suffixes = {}
+
+
+def initialise_output(config, output_sink=None):
+    global buffer_size, sink
+    buffer_size = int(config.get("output_buffer_size", default_buffer_size))
+    sink = output_sink
+
+
+def encode_simplejson(obj):
+    return simplejson.dumps(obj, use_decimal=True).encode("utf-8")
+
+
+def encode_orjson(obj):
+    try:
+        return orjson.dumps(obj)
+    except TypeError:
+        # e.g. Decimal, which only simplejson handles losslessly
+        return encode_simplejson(obj)
+
+
+encode = encode_orjson if orjson else encode_simplejson
+
+
+def get_record_prefix(stream):
+    prefix = record_prefixes.get(stream)
+    if prefix is None:
+        prefix = b'{"type":"RECORD","stream":' + encode(stream) + b',"record":'
+        record_prefixes[stream] = prefix
+    return prefix
+
+
+def get_record_suffix(dt):
+    suffix = record_suffixes.get(dt)
+    if suffix is None:
+        if dt is None:
+            suffix = b"}\n"
+        else:
+            time_extracted = strftime(dt.astimezone(pytz.utc))
+            suffix = b',"time_extracted":' + encode(time_extracted) + b"}\n"
+        record_suffixes[dt] = suffix
+    return suffix
+
+
+# records are buffered and written in large chunks rather than one write and flush per record
+def write_record(stream, record, time_extracted=None):
+    write_encoded_record(stream, encode(record), time_extracted)
+
+
+# for a record that has already been encoded
+def write_encoded_record(stream, body, time_extracted=None):
+    buffer.extend(get_record_prefix(stream))
+    buffer.extend(body)
+    buffer.extend(get_record_suffix(time_extracted))
+    if len(buffer) >= buffer_size:
+        flush()
+
+
+# already-encoded messages, which must be whole lines
+def write_raw(data):
+    buffer.extend(data)
+    if len(buffer) >= buffer_size:
+        flush()
+
+
+# any other message (SCHEMA, STATE) is written after the records before it, so STATE never overtakes the records it covers
+def write_message(message):
+    buffer.extend(encode(message.asdict()))
+    buffer.extend(b"\n")
+    flush()
+
+
+def write_state(state):
+    write_message(singer.StateMessage(value=state))
+
+
+def write_schema(stream, schema, key_properties):
+    write_message(
+        singer.SchemaMessage(
+            stream=stream, schema=schema, key_properties=key_properties
+        )
+    )
+
+
+def flush():
+    if sink is not None:
+        if buffer:
+            sink(bytes(buffer))
+            buffer.clear()
+        return
+    if buffer:
+        # anything written through the text layer has to go out first
+        sys.stdout.flush()
+        sys.stdout.buffer.write(buffer)
+        buffer.clear()
+    sys.stdout.flush()
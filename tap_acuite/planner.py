@@ -0,0 +1,178 @@
+import json
+import math
+import asyncio
+from collections import defaultdict
+import singer
+from singer.bookmarks import get_bookmark
+
+from tap_acuite import utility
+from tap_acuite.utility import (
+    get_generic,
+    get_page,
+    get_profile,
+    iter_all,
+    run_pipeline,
+    since_params,
+    modified_since,
+    settings,
+    base_workers,
+)
+from tap_acuite.fetch import (
+    get_partition_bookmarks,
+    partition_key,
+    project_needs_sync,
+    required_fields,
+    needs_detail,
+)
+from tap_acuite.limiter import current_stream
+
+logger = singer.get_logger()
+
+
+# Dry run: estimates the requests and time a sync with this catalog and state would take, from the list calls alone
+# Detail responses are never fetched, so detail requests are counted from the lists and assumed to take as long as
+# the list calls for the same stream. Pages after the first aren't fetched either, except for projects, which the
+# sub-stream estimates need in full
+async def plan(session, catalog, state):
+    # per stream: requests a sync would make, items it would fetch, and the requests made here to find out
+    estimates = defaultdict(lambda: {"requests": 0, "items": 0, "sampled": 0})
+
+    async def plan_pages(stream_id):
+        current_stream.set(stream_id)
+        profile = get_profile(stream_id)
+        bookmark = get_bookmark(state, stream_id, "since")
+        partitions = profile["partitions"]
+        partition_bookmarks = get_partition_bookmarks(state, stream_id, partitions)
+        for params in partitions or [{}]:
+            if partitions:
+                since = partition_bookmarks.get(partition_key(params))
+            else:
+                since = bookmark
+            page = await get_page(
+                session,
+                stream_id,
+                stream_id,
+                {
+                    **profile["params"],
+                    **since_params(stream_id, since),
+                    **params,
+                    "pageNumber": 1,
+                    "pageSize": profile["page_size"],
+                },
+            )
+            pages = page["Data"]["NumberOfPages"]
+            estimates[stream_id]["requests"] += pages
+            # the last page may not be full, so this is an upper bound
+            estimates[stream_id]["items"] += len(page["Data"]["Items"]) * pages
+            estimates[stream_id]["sampled"] += 1
+
+    async def plan_projects():
+        current_stream.set("projects")
+        extraction_time = singer.utils.now()
+        sub_streams = [s for s in ["audits", "hsevents"] if s in catalog]
+        index = get_bookmark(state, "project_index", "projects") or {}
+        bookmark = get_bookmark(state, "projects", "since")
+        qs = {} if sub_streams else since_params("projects", bookmark)
+
+        projects = []
+        count = 0
+        async for project in iter_all(session, "projects", "projects", qs):
+            count += 1
+            if qs or modified_since(project, bookmark):
+                estimates["projects"]["items"] += 1
+            entry = index.get(str(project["Id"]), {})
+            modified, status = project.get("DateLastModified"), project.get("Status")
+            if sub_streams and project_needs_sync(
+                entry, modified, status, sub_streams, extraction_time
+            ):
+                projects.append((project["Id"], entry))
+        pages = max(1, math.ceil(count / get_profile("projects")["page_size"]))
+        estimates["projects"]["requests"] += pages
+        estimates["projects"]["sampled"] += pages
+
+        urls = {"audits": "audits", "hsevents": "hse/events"}
+        fields = {s: required_fields(s, catalog) for s in sub_streams}
+
+        async def plan_project(project):
+            project_id, entry = project
+            for sub_stream in sub_streams:
+                current_stream.set(sub_stream)
+                since = entry.get(sub_stream) or get_bookmark(
+                    state, sub_stream, "since"
+                )
+                qs = since_params(sub_stream, since)
+                res = await get_generic(
+                    session,
+                    sub_stream,
+                    f"projects/{project_id}/{urls[sub_stream]}",
+                    {**get_profile(sub_stream)["params"], **qs},
+                )
+                items = sum(
+                    1 for row in res["Data"] if qs or modified_since(row, since)
+                )
+                estimate = estimates[sub_stream]
+                estimate["items"] += items
+                estimate["requests"] += 1
+                estimate["sampled"] += 1
+                if needs_detail(sub_stream, fields[sub_stream]):
+                    estimate["requests"] += items
+
+        await run_pipeline(
+            projects,
+            plan_project,
+            workers=settings.get("project_workers", base_workers),
+        )
+
+    plans = [
+        plan_pages(s) for s in ["companies", "locations", "people"] if s in catalog
+    ]
+    if "projects" in catalog:
+        plans.append(plan_projects())
+    await asyncio.gather(*plans)
+
+    return report(estimates)
+
+
+# request time is the measured average latency of each stream's list calls, and duration assumes every request
+# slot is kept busy
+def report(estimates):
+    concurrency = utility.limiter.maximum
+    result = {"streams": {}, "requests": 0, "request_seconds": 0.0}
+    for stream_id, estimate in sorted(estimates.items()):
+        latency = (
+            utility.limiter.costs[stream_id] / estimate["sampled"]
+            if estimate["sampled"]
+            else 0
+        )
+        request_seconds = latency * estimate["requests"]
+        result["streams"][stream_id] = {
+            "requests": estimate["requests"],
+            "items": estimate["items"],
+            "average_latency": round(latency, 3),
+            "request_seconds": round(request_seconds, 1),
+        }
+        result["requests"] += estimate["requests"]
+        result["request_seconds"] += request_seconds
+        logger.info(
+            "Plan %s: requests=%d items=%d request_time=%.1fs",
+            stream_id,
+            estimate["requests"],
+            estimate["items"],
+            request_seconds,
+        )
+    result["request_seconds"] = round(result["request_seconds"], 1)
+    result["duration_seconds"] = round(result["request_seconds"] / concurrency, 1)
+    logger.info(
+        "Plan total: requests=%d request_time=%.1fs estimated_duration=%.1fs at concurrency %d",
+        result["requests"],
+        result["request_seconds"],
+        result["duration_seconds"],
+        concurrency,
+    )
+    return result
+
+
+def write_plan(plan_file, result):
+    if plan_file:
+        with open(plan_file, "w") as file:
+            json.dump(result, file, indent=2)
@@ -0,0 +1,22 @@
+# Run-wide registry of reference entities embedded in detail payloads (e.g. hsevent categories), so each one is written
+# once per run rather than once per project it turns up in
+# Other nested lookups (e.g. AuditedCompany) only need their stream adding to streams
+streams = {"categories", "subcategories"}
+seen = {}
+# set in project shards, where records that are new to the shard are sent to the parent to check against the whole run,
+# as forward(stream_id, key, line, digest) with digest the record's fingerprint if fingerprinting
+forward = None
+
+
+def initialise_references(forward_to=None):
+    global forward
+    seen.clear()
+    forward = forward_to
+
+
+def is_new(stream_id, key):
+    keys = seen.setdefault(stream_id, set())
+    if key in keys:
+        return False
+    keys.add(key)
+    return True
@@ -0,0 +1,172 @@
+import os
+import time
+import asyncio
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from tap_acuite import output, metrics, references, fingerprints, fetch
+from tap_acuite.catalog import CatalogIndex
+
+# Optional executor stage for turning raw detail responses into encoded RECORD messages
+# With a process pool the trimming, escaping, transforming and encoding happen on other cores, and the event loop only
+# fetches responses and writes the finished lines
+base_batch_size = 50
+executor = None
+batch_size = base_batch_size
+max_pending = 1
+# the catalog index used inside the executor
+worker_catalog = None
+# reference records already rendered by this executor, which is cheaper than a repeat transform only for it to be dropped
+worker_seen = {}
+
+
+def initialise_executor(config, catalog):
+    global executor, batch_size, max_pending
+    kind = config.get("transform_executor", "none")
+    workers = int(config.get("transform_workers", os.cpu_count() or 1))
+    batch_size = max(1, int(config.get("transform_batch_size", base_batch_size)))
+    # enough batches queued to keep every worker busy, without response bodies piling up
+    max_pending = workers * 2
+
+    if kind == "none":
+        executor = None
+    elif kind == "thread":
+        initialise_worker(catalog)
+        executor = ThreadPoolExecutor(workers)
+    elif kind == "process":
+        executor = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=initialise_worker,
+            initargs=(catalog,),
+        )
+    else:
+        raise Exception(f"Unknown transform_executor {kind}")
+
+
+def shutdown_executor():
+    global executor
+    if executor is not None:
+        executor.shutdown(cancel_futures=True)
+        executor = None
+
+
+# compiled transformers can't be pickled, so each process builds its own from the raw catalog
+def initialise_worker(catalog):
+    global worker_catalog
+    worker_catalog = CatalogIndex(catalog)
+    worker_seen.clear()
+
+
+# runs in the executor. Each rendered record keeps its Id, for dropping duplicates when written, and its content hash
+# when fingerprinting
+def render_batch(prepare, rows, dt, fingerprint):
+    rendered = []
+    for row, args in rows:
+        for stream_id, record in prepare(row, worker_catalog, *args):
+            if stream_id in references.streams:
+                keys = worker_seen.setdefault(stream_id, set())
+                if record.get("Id") in keys:
+                    continue
+                keys.add(record.get("Id"))
+            stream = worker_catalog[stream_id]
+            start = time.perf_counter()
+            rec = stream.transform(record)
+            transformed = time.perf_counter()
+            body = output.encode(rec)
+            line = (
+                output.get_record_prefix(stream_id)
+                + body
+                + output.get_record_suffix(dt)
+            )
+            rendered.append(
+                (
+                    stream_id,
+                    record.get("Id"),
+                    line,
+                    fingerprints.digest(body) if fingerprint else None,
+                    transformed - start,
+                    time.perf_counter() - transformed,
+                )
+            )
+    return rendered
+
+
+# Writes the records that prepare(row, catalog, *args) produces for each row, in the order rows are added
+# Without an executor they're written straight away, otherwise rows are sent off in batches and written as they come back
+# drain must be awaited before the work is treated as done, so STATE is never written ahead of these records
+# Reference records are checked against the run-wide registry before anything is done with them
+class Renderer:
+    def __init__(self, catalog, prepare, dt):
+        self.catalog = catalog
+        self.prepare = prepare
+        self.dt = dt
+        self.batch = []
+        self.pending = deque()
+
+    async def add(self, row, *args):
+        if executor is None:
+            for stream_id, record in self.prepare(row, self.catalog, *args):
+                if stream_id not in references.streams:
+                    fetch.write_record(record, self.catalog[stream_id], self.dt)
+                    continue
+                key = record.get("Id")
+                if not references.is_new(stream_id, key):
+                    continue
+                if references.forward is None:
+                    fetch.write_record(record, self.catalog[stream_id], self.dt)
+                else:
+                    body = output.encode(self.catalog[stream_id].transform(record))
+                    references.forward(
+                        stream_id,
+                        key,
+                        output.get_record_prefix(stream_id)
+                        + body
+                        + output.get_record_suffix(self.dt),
+                        fingerprints.digest(body) if fingerprints.store else None,
+                    )
+            return
+
+        self.batch.append((row, args))
+        if len(self.batch) >= batch_size:
+            self.submit()
+        # waiting on the oldest batch holds back the pipeline, rather than letting batches pile up
+        while self.pending and (
+            self.pending[0].done() or len(self.pending) > max_pending
+        ):
+            self.write(await self.pending.popleft())
+
+    def submit(self):
+        if self.batch:
+            future = executor.submit(
+                render_batch,
+                self.prepare,
+                self.batch,
+                self.dt,
+                fingerprints.store is not None,
+            )
+            self.pending.append(asyncio.wrap_future(future))
+            self.batch = []
+
+    async def drain(self):
+        if executor is None:
+            return
+        self.submit()
+        while self.pending:
+            self.write(await self.pending.popleft())
+
+    def write(self, rendered):
+        for stream_id, key, line, digest, transform, serialize in rendered:
+            if stream_id in references.streams:
+                if not references.is_new(stream_id, key):
+                    continue
+                if references.forward is not None:
+                    references.forward(stream_id, key, line, digest)
+                    continue
+            if digest is not None and not fingerprints.store.is_changed(
+                stream_id, key, digest
+            ):
+                continue
+            output.write_raw(line)
+            metrics.record_write(stream_id, transform, serialize)
@@ -0,0 +1,109 @@
+import random
+import asyncio
+import aiohttp
+import singer
+from collections import Counter
+from tenacity import retry_if_exception
+from tenacity.stop import stop_base
+from tenacity.wait import wait_base
+
+from tap_acuite.limiter import endpoint_family
+
+logger = singer.get_logger()
+
+# defaults, all overridable from config
+base_max_attempts = 10
+base_wait = 1
+base_max_wait = 60
+
+policy = {
+    "max_attempts": base_max_attempts,
+    "wait": base_wait,
+    "max_wait": base_max_wait,
+    # retries allowed across the whole run, None for unlimited
+    "budget": None,
+}
+retries_used = 0
+retry_counts = Counter()
+
+
+def initialise_retries(config):
+    global retries_used
+    policy["max_attempts"] = int(config.get("max_attempts", base_max_attempts))
+    policy["wait"] = float(config.get("retry_wait", base_wait))
+    policy["max_wait"] = float(config.get("retry_max_wait", base_max_wait))
+    budget = config.get("retry_budget")
+    policy["budget"] = None if budget is None else int(budget)
+    retries_used = 0
+    retry_counts.clear()
+
+
+# 5xx, 429, timeouts and dropped connections are worth retrying, anything else (e.g. 404) will fail the same way again
+def is_retryable(exception):
+    if isinstance(exception, aiohttp.ClientResponseError):
+        return exception.status >= 500 or exception.status == 429
+    return isinstance(
+        exception,
+        (
+            asyncio.TimeoutError,
+            aiohttp.ClientConnectionError,
+            aiohttp.ClientPayloadError,
+        ),
+    )
+
+
+class stop_policy(stop_base):
+    def __call__(self, retry_state):
+        if retry_state.attempt_number >= policy["max_attempts"]:
+            return True
+        if policy["budget"] is not None and retries_used >= policy["budget"]:
+            logger.warning("Retry budget of %d exhausted", policy["budget"])
+            return True
+        return False
+
+
+# exponential backoff with full jitter, so retries from concurrent requests don't land at the same moment
+class wait_policy(wait_base):
+    def __call__(self, retry_state):
+        window = policy["wait"] * 2 ** (retry_state.attempt_number - 1)
+        return random.uniform(0, min(policy["max_wait"], window))
+
+
+def record_retry(retry_state):
+    global retries_used
+    retries_used += 1
+    # request(session, url, headers)
+    url = (
+        retry_state.args[1] if len(retry_state.args) > 1 else retry_state.kwargs["url"]
+    )
+    retry_counts[endpoint_family(url)] += 1
+    logger.debug(
+        "Retrying %s in %.1fs after attempt %d failed: %r",
+        url,
+        retry_state.next_action.sleep,
+        retry_state.attempt_number,
+        retry_state.outcome.exception(),
+    )
+
+
+# as the request acquires its concurrency slot inside the retried function, the slot is free while waiting
+retry_kwargs = {
+    "retry": retry_if_exception(is_retryable),
+    "stop": stop_policy(),
+    "wait": wait_policy(),
+    "before_sleep": record_retry,
+    "reraise": True,
+}
+
+
+# retries made in another process, e.g. a project shard
+def merge_retries(counts):
+    global retries_used
+    retry_counts.update(counts)
+    retries_used += sum(counts.values())
+
+
+def log_retries():
+    for family, count in sorted(retry_counts.items()):
+        logger.info("Retries %s: %d", family, count)
+    logger.info("Retries total: %d", retries_used)
@@ -0,0 +1,219 @@
+import os
+import zlib
+import queue
+import asyncio
+import traceback
+import multiprocessing
+import singer
+from singer.bookmarks import get_bookmark
+
+from tap_acuite import (
+    utility,
+    output,
+    metrics,
+    render,
+    references,
+    fingerprints,
+    budget,
+    fetch,
+)
+from tap_acuite.catalog import CatalogIndex
+from tap_acuite.budget import BudgetExhausted
+from tap_acuite.retries import initialise_retries, merge_retries, retry_counts
+
+logger = singer.get_logger()
+
+# the worker's project admission, whose estimate of a project's requests goes back to the parent
+admission = None
+
+# Sharded project sync: audits and hsevents for the projects are split across worker processes, each with its own
+# event loop and session, so decoding and transforming use more than one core
+# Workers send their output back as chunks of whole messages and the parent is the only writer. A worker reports a
+# project as finished only after sending its records, so STATE (always written by the parent) never overtakes them
+
+
+# the same project always goes to the same shard, so per-shard response caches stay warm between runs
+def shard_projects(projects, processes):
+    shards = [[] for _ in range(processes)]
+    for project in projects:
+        shards[zlib.crc32(str(project[0]).encode("utf-8")) % processes].append(project)
+    return [shard for shard in shards if shard]
+
+
+# the concurrency limits are shared between the workers rather than each getting the full amount
+def worker_config(config, number, processes):
+    config = dict(config)
+    maximum = int(config.get("max_concurrency", 32))
+    config["max_concurrency"] = max(1, maximum // processes)
+    config["initial_concurrency"] = max(
+        1, min(int(config.get("initial_concurrency", 8)), config["max_concurrency"])
+    )
+    if config.get("cache_dir"):
+        config["cache_dir"] = os.path.join(config["cache_dir"], f"shard-{number}")
+    # workers are daemon processes, which can't start a process pool of their own
+    if config.get("transform_executor") == "process":
+        config["transform_executor"] = "thread"
+    # the rest of the run's budget is shared between the workers too
+    remaining_requests = budget.budget.remaining_requests()
+    if remaining_requests is not None:
+        config["max_requests"] = remaining_requests // processes
+    remaining_duration = budget.budget.remaining_duration()
+    if remaining_duration is not None:
+        config["max_duration"] = remaining_duration
+    return config
+
+
+async def run_shards(projects, catalog, state, extraction_time, finish_project):
+    processes = int(utility.settings.get("project_processes"))
+    shards = shard_projects(projects, processes)
+    context = multiprocessing.get_context("spawn")
+    # bounded, so workers wait for the parent rather than output piling up in memory
+    messages = context.Queue(len(shards) * 4)
+    workers = [
+        context.Process(
+            target=run_worker,
+            args=(
+                number,
+                worker_config(utility.settings, number, len(shards)),
+                catalog.catalog,
+                state,
+                shard,
+                extraction_time,
+                messages,
+            ),
+            daemon=True,
+        )
+        for number, shard in enumerate(shards)
+    ]
+    for worker in workers:
+        worker.start()
+    logger.info("Syncing %d projects across %d processes", len(projects), len(workers))
+
+    loop = asyncio.get_event_loop()
+    running = len(workers)
+    stopped = False
+    project_requests = []
+    try:
+        while running:
+            message = await loop.run_in_executor(None, receive, messages, workers)
+            kind = message[0]
+            if kind == "output":
+                output.write_raw(message[1])
+            elif kind == "reference":
+                # checked again here, as other shards may already have written it
+                stream_id, key, line, digest = message[1:]
+                if references.is_new(stream_id, key) and (
+                    digest is None
+                    or fingerprints.store.is_changed(stream_id, key, digest)
+                ):
+                    output.write_raw(line)
+                    # counted here, as only the records a shard writes itself are in its metrics
+                    metrics.record_write(stream_id, 0, 0)
+            elif kind == "project":
+                finish_project(message[1], message[2])
+            elif kind in ("done", "stopped"):
+                # the shard's fingerprints are committed with everything else, once the run's state is written
+                if fingerprints.store is not None:
+                    fingerprints.store.merge(message[2])
+                # reported along with the main process's own at the end of the run
+                metrics.merge(message[3]["metrics"])
+                merge_retries(message[3]["retries"])
+                # for the scheduler's cost estimates, which would otherwise miss audits and hsevents
+                utility.limiter.add_costs(message[3]["costs"])
+                if message[3]["project_requests"] is not None:
+                    project_requests.append(message[3]["project_requests"])
+                stopped = stopped or kind == "stopped"
+                running -= 1
+            else:
+                raise Exception(f"Project shard {message[1]} failed:\n{message[2]}")
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+            worker.join()
+    fetch.save_project_estimate(state, max(project_requests, default=None))
+    if stopped:
+        raise BudgetExhausted("Budget used up in a project shard")
+
+
+# waits for the next message, noticing a worker that died without reporting it (e.g. killed for running out of memory)
+def receive(messages, workers):
+    while True:
+        try:
+            return messages.get(timeout=1)
+        except queue.Empty:
+            for number, worker in enumerate(workers):
+                if worker.exitcode not in (None, 0):
+                    return ("error", number, f"exited with code {worker.exitcode}")
+
+
+# what the parent merges from a shard once it's finished
+def worker_results():
+    return {
+        "metrics": metrics.export(),
+        "retries": dict(retry_counts),
+        "costs": dict(utility.limiter.costs),
+        "project_requests": admission.observed() if admission is not None else None,
+    }
+
+
+def run_worker(number, config, catalog, state, projects, extraction_time, messages):
+    try:
+        asyncio.run(
+            sync_shard(config, catalog, state, projects, extraction_time, messages)
+        )
+        pending = fingerprints.store.pending if fingerprints.store is not None else {}
+        messages.put(("done", number, pending, worker_results()))
+    except BudgetExhausted:
+        # projects it finished have already been reported, so the parent can stop cleanly
+        pending = fingerprints.store.pending if fingerprints.store is not None else {}
+        messages.put(("stopped", number, pending, worker_results()))
+    except BaseException:
+        messages.put(("error", number, traceback.format_exc()))
+
+
+async def sync_shard(config, catalog, state, projects, extraction_time, messages):
+    global admission
+    async with utility.create_session(config) as session:
+        utility.initialise_limiter(config)
+        utility.initialise_settings(config)
+        initialise_retries(config)
+        utility.initialise_cache(config)
+        # blocks the worker's loop while the queue is full, which is the point: the parent is the bottleneck
+        output.initialise_output(config, lambda chunk: messages.put(("output", chunk)))
+        metrics.initialise_metrics()
+        render.initialise_executor(config, catalog)
+        references.initialise_references(
+            lambda *reference: messages.put(("reference", *reference))
+        )
+        # checked against the committed fingerprints here, but only the parent commits
+        fingerprints.initialise_fingerprints(config)
+        budget.initialise_budget(config)
+
+        index = CatalogIndex(catalog)
+        sub_streams = [s for s in ["audits", "hsevents"] if s in index]
+
+        async def sync(project):
+            new_entry = await fetch.sync_project(
+                session, project, index, state, sub_streams, extraction_time
+            )
+            output.flush()
+            messages.put(("project", str(project[0]), new_entry))
+
+        admission = budget.Admission(
+            get_bookmark(state, "scheduler", "project_requests")
+        )
+        try:
+            await utility.run_pipeline(
+                projects,
+                admission.wrap(sync),
+                workers=utility.settings.get("project_workers", utility.base_workers),
+            )
+            admission.check()
+        finally:
+            render.shutdown_executor()
+            output.flush()
+            utility.limiter.log_limits(force=True)
+            if utility.response_cache:
+                utility.response_cache.save()
+                utility.response_cache.log_stats()
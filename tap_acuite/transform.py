@@ -0,0 +1,197 @@
+import datetime
+import singer
+from singer import metadata
+from singer.transform import string_to_datetime
+from singer.utils import strftime
+
+# sentinel for a failed transform, as None is a valid transformed value
+FAILED = object()
+
+
+# Builds a function equivalent to singer.Transformer().transform(row, schema, metadata=to_map(mdata))
+# The schema walk and metadata lookups happen once here rather than for every record
+def compile_transformer(schema, mdata):
+    mdata_map = metadata.to_map(mdata) if isinstance(mdata, list) else mdata
+    excluded = get_excluded_fields(mdata_map)
+    compiled = compile_schema(schema, excluded)
+
+    def transform(row):
+        result = compiled(row)
+        if result is FAILED:
+            # rerun through singer so the error matches what the standard transformer would raise
+            with singer.Transformer() as transformer:
+                return transformer.transform(row, schema, metadata=mdata_map)
+        return result
+
+    return transform
+
+
+# fields that singer.Transformer would drop before transforming, based on metadata
+def get_excluded_fields(mdata_map):
+    excluded = set()
+    for breadcrumb, md in (mdata_map or {}).items():
+        if len(breadcrumb) != 2 or breadcrumb[0] != "properties":
+            continue
+        inclusion = md.get("inclusion")
+        if inclusion == "automatic":
+            continue
+        if md.get("selected") is False or inclusion == "unsupported":
+            excluded.add(breadcrumb[1])
+    return excluded
+
+
+def compile_schema(schema, excluded=frozenset()):
+    if "anyOf" in schema:
+        options = [compile_schema(s) for s in schema["anyOf"]]
+        return first_success(options)
+
+    if "type" not in schema:
+        # no typing information so don't bother transforming it
+        return lambda data: data
+
+    types = schema["type"]
+    if not isinstance(types, list):
+        types = [types]
+    # same ordering as singer: try null last
+    types = [t for t in types if t != "null"] + (["null"] if "null" in types else [])
+
+    options = [compile_type(t, schema, excluded) for t in types]
+    if len(options) == 1:
+        return options[0]
+    return first_success(options)
+
+
+def first_success(options):
+    def transform(data):
+        for option in options:
+            result = option(data)
+            if result is not FAILED:
+                return result
+        return FAILED
+
+    return transform
+
+
+def compile_type(typ, schema, excluded):
+    if typ == "null":
+        return transform_null
+    if schema.get("format") == "date-time":
+        return transform_datetime
+    if typ == "object":
+        return compile_object(schema, excluded)
+    if typ == "array":
+        return compile_array(schema["items"])
+    return SCALARS.get(typ, lambda data: FAILED)
+
+
+def compile_object(schema, excluded):
+    if schema.get("patternProperties"):
+        # not used by any Acuite schema, so leave it to singer
+        return lambda data: FAILED
+
+    properties = schema.get("properties", {})
+    if properties == {}:
+        # objects without properties are passed through untouched
+        return lambda data: data if isinstance(data, dict) else FAILED
+
+    fields = {
+        name: compile_schema(sub_schema)
+        for name, sub_schema in properties.items()
+        if name not in excluded
+    }
+
+    def transform(data):
+        if not isinstance(data, dict):
+            return FAILED
+        result = {}
+        for key, value in data.items():
+            func = fields.get(key)
+            # anything not in the schema (or deselected) is projected out
+            if func is None:
+                continue
+            value = func(value)
+            if value is FAILED:
+                return FAILED
+            result[key] = value
+        return result
+
+    return transform
+
+
+def compile_array(items_schema):
+    item = compile_schema(items_schema)
+
+    def transform(data):
+        if not isinstance(data, list):
+            return FAILED
+        result = []
+        for row in data:
+            value = item(row)
+            if value is FAILED:
+                return FAILED
+            result.append(value)
+        return result
+
+    return transform
+
+
+def transform_null(data):
+    return None if data is None or data == "" else FAILED
+
+
+def transform_datetime(data):
+    if data is None or data == "":
+        return FAILED
+    # Acuite returns naive ISO dates, which fromisoformat parses far faster than dateutil
+    try:
+        dt = datetime.datetime.fromisoformat(data)
+        if dt.tzinfo is None:
+            return strftime(dt.replace(tzinfo=datetime.timezone.utc))
+    except (TypeError, ValueError):
+        pass
+    value = string_to_datetime(data)
+    return FAILED if value is None else value
+
+
+def transform_string(data):
+    if data is None:
+        return FAILED
+    try:
+        return str(data)
+    except Exception:
+        return FAILED
+
+
+def transform_integer(data):
+    if isinstance(data, str):
+        data = data.replace(",", "")
+    try:
+        return int(data)
+    except Exception:
+        return FAILED
+
+
+def transform_number(data):
+    if isinstance(data, str):
+        data = data.replace(",", "")
+    try:
+        return float(data)
+    except Exception:
+        return FAILED
+
+
+def transform_boolean(data):
+    if isinstance(data, str) and data.lower() == "false":
+        return False
+    try:
+        return bool(data)
+    except Exception:
+        return FAILED
+
+
+SCALARS = {
+    "string": transform_string,
+    "integer": transform_integer,
+    "number": transform_number,
+    "boolean": transform_boolean,
+}
@@ -1,43 +1,291 @@
 import os
+import json
+import time
 import asyncio
-from tenacity import retry, stop_after_attempt
-from datetime import datetime
+import inspect
+import aiohttp
+from email.utils import parsedate_to_datetime
+from tenacity import retry
+from datetime import datetime, timezone
+from tap_acuite.limiter import AdaptiveLimiter, endpoint_family
+from tap_acuite.retries import retry_kwargs
+from tap_acuite.cache import ResponseCache, base_max_bytes
+from tap_acuite import metrics, budget
 
+# orjson and ijson are optional (the "fast" extra)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# orjson decodes straight from the response bytes, several times faster than the json module
+loads = orjson.loads if orjson else json.loads
 
 # constants
-base_url = "https://api.acuite.io/"
+default_base_url = "https://api.acuite.io/"
+base_url = default_base_url
 base_page_size = 1000
-sem = None
+base_read_ahead = 4
+base_workers = 8
+# some endpoints are very slow and take 30s to return normally, so allow plenty of time between reads
+base_connect_timeout = 15
+base_read_timeout = 90
+# the DNS cache and idle connections are kept far longer than aiohttp's defaults, as every request goes to one host
+base_dns_cache_ttl = 300
+base_keepalive_timeout = 60
+# How each endpoint is requested: page_size for list calls, params sent on every call, the incremental filters the
+# endpoint supports server-side (rows from anything else are filtered client-side), and partitions, sets of params
+# that are each listed separately and together make up the whole stream
+# Overridable per endpoint with "request_profiles" in config.json, e.g. {"people": {"page_size": 200}}
+base_request_profiles = {
+    "companies": {"params": {"includeDeleted": True}, "filters": ["lastModifiedSince"]},
+    "locations": {
+        "filters": ["lastModifiedSince"],
+        "partitions": [{"countryId": 27}, {"countryId": 44}],
+    },
+    # people pages are slow to build, so are kept small to stay well inside the read timeout
+    "people": {
+        "page_size": 100,
+        "params": {"includeDeleted": "true"},
+        "filters": ["lastModifiedSince"],
+    },
+    "projects": {
+        "params": {"includeArchived": "true"},
+        "filters": ["lastModifiedSince"],
+    },
+    "audits": {"filters": ["lastModifiedSince"]},
+    "hsevents": {"filters": ["lastModifiedSince"]},
+}
+limiter = None
+response_cache = None
+settings = {}
 base_format = "%Y-%m-%dT%H:%M:%S"
 
-# semaphore needs to be initialised within the main asyncio loop or it will make its own and cause issues
-def initialise_semaphore():
-    global sem
-    sem = asyncio.Semaphore(32)
+# one pooled connector for the whole run, so connections (and their TLS sessions) are reused across requests
+def create_session(config):
+    connection_limit = int(config.get("max_concurrency", 32))
+    connector = aiohttp.TCPConnector(
+        limit=int(config.get("connection_limit", connection_limit)),
+        limit_per_host=int(config.get("connection_limit_per_host", 0)),
+        ttl_dns_cache=int(config.get("dns_cache_ttl", base_dns_cache_ttl)),
+        use_dns_cache=True,
+        keepalive_timeout=float(
+            config.get("keepalive_timeout", base_keepalive_timeout)
+        ),
+        ssl=None if config.get("verify_ssl", True) else False,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=config.get("request_timeout"),
+        # sock_connect rather than connect, which would also count time spent waiting for a free pooled connection
+        sock_connect=float(config.get("connect_timeout", base_connect_timeout)),
+        sock_read=float(config.get("read_timeout", base_read_timeout)),
+    )
+    # aiohttp asks for gzip/deflate by default, which can be turned off if the CPU cost outweighs the bandwidth saved
+    skip_auto_headers = [] if config.get("compression", True) else ["Accept-Encoding"]
+    return aiohttp.ClientSession(
+        connector=connector,
+        headers={"AcuiteApiKey": config["api_key"]},
+        timeout=timeout,
+        skip_auto_headers=skip_auto_headers,
+    )
+
+
+# only enabled when a cache_dir is configured
+def initialise_cache(config):
+    global response_cache
+    if config.get("cache_dir"):
+        response_cache = ResponseCache(
+            config["cache_dir"], int(config.get("cache_max_bytes", base_max_bytes))
+        )
+    else:
+        response_cache = None
+
+
+# limiter needs to be initialised within the main asyncio loop or it will make its own and cause issues
+def initialise_limiter(config):
+    global limiter
+    limiter = AdaptiveLimiter(
+        maximum=int(config.get("max_concurrency", 32)),
+        initial=int(config.get("initial_concurrency", 8)),
+    )
+
+
+def initialise_settings(config):
+    global base_url
+    # overridable so the tap can be pointed at a local simulator
+    base_url = config.get("base_url", default_base_url)
+    settings.clear()
+    settings.update(config)
+
+
+def get_profile(source):
+    base = base_request_profiles.get(source, {})
+    override = settings.get("request_profiles", {}).get(source, {})
+    return {
+        "page_size": int(
+            override.get("page_size", base.get("page_size", base_page_size))
+        ),
+        "params": {**base.get("params", {}), **override.get("params", {})},
+        "filters": override.get("filters", base.get("filters", [])),
+        "partitions": override.get("partitions", base.get("partitions", [])),
+    }
+
+
+# the incremental filter for the query string, or {} if there's no bookmark or the endpoint can't filter server-side
+def since_params(source, bookmark):
+    if bookmark is None or "lastModifiedSince" not in get_profile(source)["filters"]:
+        return {}
+    return {"lastModifiedSince": bookmark}
+
+
+# client-side equivalent of lastModifiedSince, for rows that weren't filtered by the API
+# only using string sorting rather than date comparison, but ISO date format means that this works perfectly
+def modified_since(row, bookmark):
+    modified = row.get("DateLastModified")
+    return bookmark is None or modified is None or modified >= bookmark
 
 
 # requests don't normally fail, but sometimes there's an intermittent 500
-@retry(stop=stop_after_attempt(10))
+# parse, if given, reads the response body itself as it streams in, and its result is returned in place of the bytes
+@retry(**retry_kwargs)
+async def request(session, url, headers=None, parse=None):
+    # raises BudgetExhausted, which isn't retried, once the run's budget is used up
+    budget.budget.spend()
+    family = endpoint_family(url)
+    queued = time.monotonic()
+    await limiter.acquire(family)
+    start = time.monotonic()
+    # anything that doesn't get as far as a response (timeouts, connection resets) counts as a failure
+    outcome = "failed"
+    retry_after = None
+    size = 0
+    try:
+        # print("### URL:", base_url + url)
+        async with await session.get(base_url + url, headers=headers) as resp:
+            if resp.status == 429:
+                outcome = "throttled"
+                retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+            elif 400 <= resp.status < 500:
+                # client errors say nothing about how loaded the endpoint is
+                outcome = None
+            resp.raise_for_status()
+            if parse is None:
+                body = await resp.read()
+                size = len(body)
+            else:
+                body = await parse(resp.content)
+                size = resp.content.total_bytes
+            outcome = "ok"
+            return resp.status, resp.headers, body
+    except asyncio.CancelledError:
+        outcome = None
+        raise
+    finally:
+        latency = time.monotonic() - start
+        await limiter.release(family, latency, outcome, retry_after)
+        metrics.record_request(
+            family, latency, start - queued, size, failed=outcome != "ok"
+        )
+
+
 async def get_generic(session, source, url, qs={}):
-    async with sem:
-        query_string = build_query_string(qs)
-        # print("### URL:", base_url + url + query_string)
-        async with await session.get(
-            base_url + url + query_string, raise_for_status=True
-        ) as resp:
-            return await resp.json()
+    status, headers, body = await request(session, url + build_query_string(qs))
+    return loads(body)
 
 
-async def get_all(session, source, url, extra_query_string={}):
-    page_size = base_page_size if source != "people" else 100
+scalar_events = {"null", "boolean", "integer", "double", "number", "string"}
+
+
+# Builds a list page from the response stream, one item at a time, so the full body and the full object tree are
+# never held at the same time
+async def parse_page(content):
+    data = {}
+    items = []
+    builder = None
+    async for prefix, event, value in ijson.parse_async(content, use_float=True):
+        if prefix == "Data.Items.item" and event == "start_map":
+            builder = ijson.ObjectBuilder()
+        if builder is not None:
+            builder.event(event, value)
+            if prefix == "Data.Items.item" and event == "end_map":
+                items.append(builder.value)
+                builder = None
+        elif (
+            prefix.count(".") == 1
+            and prefix.startswith("Data.")
+            and event in scalar_events
+        ):
+            data[prefix[len("Data.") :]] = value
+    data["Items"] = items
+    return {"Data": data}
+
+
+async def get_page(session, source, url, qs):
+    if ijson is None or not settings.get("incremental_parsing", False):
+        return await get_generic(session, source, url, qs)
+    status, headers, page = await request(
+        session, url + build_query_string(qs), parse=parse_page
+    )
+    return page
+
 
-    async def get_page(page_number):
+# For detail endpoints: served from the response cache while the item's version (its DateLastModified) is unchanged,
+# otherwise fetched with a conditional request where possible
+async def get_cached(session, source, url, version=None):
+    if response_cache is None:
+        return await get_generic(session, source, url)
+
+    body = response_cache.get(url, version)
+    if body is None:
+        status, headers, body = await request(
+            session, url, response_cache.validators(url)
+        )
+        if status == 304:
+            body = response_cache.revalidate(url, version)
+            if body is None:
+                # cached file has gone missing, so fetch it properly
+                status, headers, body = await request(session, url)
+        if status != 304:
+            response_cache.put(
+                url, version, body, headers.get("ETag"), headers.get("Last-Modified")
+            )
+    return loads(body)
+
+
+# Retry-After is either a number of seconds or an HTTP date
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(
+            0,
+            (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(),
+        )
+    except (TypeError, ValueError):
+        return None
+
+
+async def iter_all(session, source, url, extra_query_string={}):
+    profile = get_profile(source)
+    page_size = profile["page_size"]
+    read_ahead = max(1, int(settings.get("page_read_ahead", base_read_ahead)))
+
+    async def get_numbered_page(page_number):
         return (
-            await get_generic(
+            await get_page(
                 session,
                 source,
                 url,
                 {
+                    **profile["params"],
                     **extra_query_string,
                     "pageNumber": page_number,
                     "pageSize": page_size,
@@ -45,17 +293,122 @@ async def get_all(session, source, url, extra_query_string={}):
             )
         )["Data"]
 
-    json = await get_page(1)
+    first_page = await get_numbered_page(1)
+    remaining = iter(range(2, 1 + first_page["NumberOfPages"]))
+    pending = set()
 
-    if json["NumberOfPages"] == 1:
-        return json["Items"]
+    def schedule():
+        for page_number in remaining:
+            pending.add(asyncio.ensure_future(get_numbered_page(page_number)))
+            if len(pending) >= read_ahead:
+                break
+
+    # yield each page as soon as it arrives, with at most read_ahead pages requested but not yet consumed
+    try:
+        # request the next pages before the consumer starts on the first one
+        schedule()
+        for row in first_page["Items"]:
+            yield row
+        del first_page
+
+        while True:
+            schedule()
+            if not pending:
+                break
+
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                for row in task.result()["Items"]:
+                    yield row
+    finally:
+        # consumer stopped early or errored, so don't leave requests running
+        for task in pending:
+            task.cancel()
+
+
+# More convenient to use but has to all be held in memory, so use iter_all instead for resources with many rows
+async def get_all(session, source, url, extra_query_string={}):
+    return [row async for row in iter_all(session, source, url, extra_query_string)]
+
+
+# handle can be a plain function or return an awaitable, e.g. to wait on a transform executor
+async def call(handle, result):
+    result = handle(result)
+    if inspect.isawaitable(result):
+        await result
 
-    pages = await asyncio.gather(
-        *[get_page(page_number) for page_number in range(2, 1 + json["NumberOfPages"])]
-    )
-    pages.insert(0, json)
 
-    return [row for page in pages for row in page["Items"]]
+# Feeds items to a fixed pool of fetch workers through a bounded queue, with every result handed to handle one at a time
+# The number of tasks and results held in memory stays constant regardless of how many items there are
+# With ordered=True results are handed over in the same order as items, rather than as they complete
+async def run_pipeline(items, fetch, handle=None, workers=base_workers, ordered=False):
+    workers = max(1, int(workers))
+    inbox = asyncio.Queue(workers * 2)
+    outbox = asyncio.Queue(workers * 2)
+    # when ordered, caps how far ahead of the oldest unhandled item the workers can get
+    window = asyncio.Semaphore(workers * 2)
+    done = object()
+
+    async def produce():
+        index = 0
+        if hasattr(items, "__aiter__"):
+            async for item in items:
+                await window.acquire()
+                await inbox.put((index, item))
+                index += 1
+        else:
+            for item in items:
+                await window.acquire()
+                await inbox.put((index, item))
+                index += 1
+        for _ in range(workers):
+            await inbox.put(done)
+
+    async def work():
+        while True:
+            entry = await inbox.get()
+            if entry is done:
+                await outbox.put(done)
+                return
+            index, item = entry
+            await outbox.put((index, await fetch(item)))
+
+    async def consume():
+        finished = 0
+        waiting = {}
+        next_index = 0
+        while finished < workers:
+            entry = await outbox.get()
+            if entry is done:
+                finished += 1
+                continue
+            if not ordered:
+                window.release()
+                if handle is not None:
+                    await call(handle, entry[1])
+                continue
+            waiting[entry[0]] = entry[1]
+            while next_index in waiting:
+                result = waiting.pop(next_index)
+                next_index += 1
+                window.release()
+                if handle is not None:
+                    await call(handle, result)
+
+    tasks = [asyncio.ensure_future(produce())]
+    tasks += [asyncio.ensure_future(work()) for _ in range(workers)]
+    tasks.append(asyncio.ensure_future(consume()))
+    try:
+        # surface a failure in any stage rather than waiting on a queue forever
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in tasks:
+            if task.done() and not task.cancelled() and task.exception():
+                raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
 
 
 def format_date(dt, format=base_format):
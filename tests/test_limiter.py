@@ -0,0 +1,92 @@
+# Drives the adaptive limiter through the tap's request path against benchmarks/simulator.py
+# Run from the repository root: python -m pytest tests
+import os
+import sys
+import time
+import asyncio
+from aiohttp import web
+
+tests_dir = os.path.dirname(os.path.realpath(__file__))
+root_dir = os.path.dirname(tests_dir)
+sys.path.insert(0, root_dir)
+sys.path.insert(0, os.path.join(root_dir, "benchmarks"))
+
+from simulator import Simulator, parse_args
+from tap_acuite import utility
+from tap_acuite.retries import initialise_retries
+
+initial_concurrency = 8
+
+
+# starts the simulator on a free port, then makes the given requests through utility.request from concurrent
+# requesters, returning the limiter's families once they're all done
+async def drive(simulator_args, urls, requesters=32):
+    simulator = Simulator(parse_args(simulator_args))
+    runner = web.AppRunner(simulator.app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    config = {
+        "api_key": "x",
+        "base_url": f"http://127.0.0.1:{port}/",
+        "retry_wait": 0.01,
+    }
+    utility.initialise_settings(config)
+    utility.initialise_limiter({"initial_concurrency": initial_concurrency})
+    initialise_retries(config)
+    queue = asyncio.Queue()
+    for url in urls:
+        queue.put_nowait(url)
+
+    async def requester(session):
+        while not queue.empty():
+            await utility.request(session, queue.get_nowait())
+
+    try:
+        async with utility.create_session(config) as session:
+            await asyncio.gather(*(requester(session) for _ in range(requesters)))
+    finally:
+        await runner.cleanup()
+    return utility.limiter.families
+
+
+# response times that vary with what's asked for, but not with load, shouldn't be mistaken for congestion
+def test_variable_latency_does_not_reduce_limit():
+    families = asyncio.run(
+        drive(
+            [
+                "--latency",
+                "0.05",
+                "--slow",
+                "projects/{id}/audits=0.25",
+                "--slow-rate",
+                "0.5",
+            ],
+            ["projects/1/audits"] * 300,
+        )
+    )
+    family = families["projects/{id}/audits"]
+    assert family.failures == family.throttles == 0
+    assert family.limit > initial_concurrency
+
+
+def test_failures_reduce_limit():
+    families = asyncio.run(drive(["--fail-rate", "0.3"], ["projects/1/audits"] * 200))
+    family = families["projects/{id}/audits"]
+    assert family.failures > 0
+    assert family.limit < initial_concurrency
+
+
+def test_throttling_reduces_limit_and_waits_for_retry_after():
+    start = time.monotonic()
+    families = asyncio.run(
+        drive(
+            ["--throttle-rate", "0.3", "--retry-after", "1"], ["projects/1/audits"] * 20
+        )
+    )
+    family = families["projects/{id}/audits"]
+    assert family.throttles > 0
+    assert family.limit < initial_concurrency
+    assert time.monotonic() - start >= 1